@@ -0,0 +1,268 @@
+# ==========================
+# File Name: ISD_Backfill.py
+# ==========================
+
+import os
+import shutil
+
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from ISD_Obs import DATE_FMT, convertISD, writeDays, uploadISD, connectHindsight
+from ISD_Lite_Processing.processISDLite import processISDLite, fetchISD, stationFiles, BOUNDS_PAD
+from ISD_Lite_Processing.ISDfilename import ISDfilename
+from ISD_Lite_Processing.downloadISD import ISD_LITE_URL
+from ISD_Lite_Processing.metrics import RunMetrics
+from ISD_Lite_Processing.shardManifest import Manifest, LockHeartbeat, planShards, waitForLock
+
+def ISD_Backfill(starttime, endtime, savedir, stationList, variableList, overwrite_table=False, group_size=25,
+                 workers=1, manifest_dir=None, lock_timeout=6 * 3600, baseurl=ISD_LITE_URL, download_workers=8,
+                 float_format=None, compact=False, cache=False, upload_workers=1, batch_days=None):
+    """
+    Backfills ISD Lite Data into the Hindsight Database in shards that can be resumed. The stations
+    are split into groups of group_size and the window into calendar months, and each group-month
+    is one shard. A manifest in manifest_dir records how far every shard got (downloaded, processed,
+    uploaded), so calling ISD_Backfill again with the same arguments picks up where an interrupted
+    run stopped.
+
+    Shards are handed out with lock files, so several worker processes, or several hosts sharing
+    savedir and manifest_dir, can work on one backfill at the same time. Run the same call on each host. The uploads
+    of different shards take turns, so two shards never create the same day's table at once.
+
+    Parameters:
+        starttime (String) - the start time in format yyyymmdd_HH.
+        endtime (String) - the end time in format yyyymmdd_HH.
+        savedir (String) - the directory for the downloaded ISD files and the manifest.
+        stationList (String) - the name of the file containing the list of stations to work from.
+        variableList (String) - the name of the file containing the list of variables you're interested in.
+        overwrite_table (Boolean) - Default: False, whether or not you want to overwrite data in existing tables.
+            When False, days whose tables existed when the backfill started are skipped.
+        group_size (int) - Default: 25, the number of stations in each shard.
+        workers (int) - Default: 1, the number of worker processes on this host. Scripts that use more than
+            one must call ISD_Backfill from under if __name__ == '__main__'.
+        manifest_dir (String) - Default: None, where to keep the manifest and the shards' .csv files. Defaults
+            to a backfill directory next to savedir, e.g. /data/ISDdir-backfill/ for /data/ISDdir/. It can't
+            be inside savedir, where an ISD_Obs run would upload and delete the shards' files.
+        lock_timeout (float) - Default: 6 hours, seconds after which the lock of a shard that hasn't made
+            progress is taken over by another worker.
+        baseurl (String) - Default: the NCEI ISD Lite archive, the root URL to download ISD Lite files from.
+        download_workers (int) - Default: 8, the maximum number of simultaneous downloads in each worker.
+        float_format (String) - Default: None, a printf style format for the values in the .csv files.
+        compact (Boolean) - Default: False, process the data in the compact schema to save memory.
+        cache (Boolean or String) - Default: False, keep parsed station-years in a cache. See processISDLite.
+        upload_workers (int) - Default: 1, the number of days of a shard uploaded at the same time. See uploadISD.
+        batch_days (int) - Default: None, upload this many days of a shard in one block. See uploadBlock.
+    Returns:
+        (dict) - the number of shards in each state.
+    """
+
+    print('Starting backfill.')
+
+    stations = readList(stationList)
+    variables = readList(variableList)
+    start = datetime.strptime(starttime, DATE_FMT)
+    end = datetime.strptime(endtime, DATE_FMT)
+
+    # The shards write their .csv files under the manifest, so keep it out of savedir where an
+    # ISD_Obs run on the same directory would find them.
+
+    if manifest_dir is None:
+        manifest_dir = savedir.rstrip('/\\') + '-backfill/'
+    if insideDirectory(manifest_dir, savedir):
+        raise ValueError('manifest_dir %s is inside savedir %s. Choose a directory outside of it.' %
+                         (manifest_dir, savedir))
+    manifest = Manifest(manifest_dir)
+
+    # Remember which days already had tables when the backfill started. Those are the days to
+    # skip, tables created by earlier shards still need the data of the other station groups.
+
+    params = {'starttime': starttime, 'endtime': endtime, 'stations': stations, 'variables': variables,
+              'group_size': group_size, 'overwrite_table': overwrite_table}
+    info = dict()
+    if not manifest.exists():
+        existing = list()
+        if not overwrite_table:
+            conn = connectHindsight()
+            existing = existingDays(conn, start, end)
+            conn.close()
+        info = {'existing_days': existing}
+    manifest.create(params, planShards(stations, start, end, group_size), info)
+
+    print('Shards: %s' % manifest.summary())
+
+    options = {'savedir': savedir, 'variables': variables, 'bounds': (start, end), 'lock_timeout': lock_timeout,
+               'baseurl': baseurl, 'download_workers': download_workers, 'float_format': float_format,
+               'compact': compact, 'cache': cache, 'upload_workers': upload_workers,
+               'batch_days': batch_days}
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(backfillWorker, [manifest_dir] * workers, [options] * workers))
+    else:
+        backfillWorker(manifest_dir, options)
+
+    summary = manifest.summary()
+    print('Backfill finished. %d of %d shards uploaded.' % (summary['uploaded'], sum(summary.values())))
+    return summary
+
+def readList(filename):
+    """
+    Read a list of stations or variables, one per line.
+    """
+
+    items = list()
+    with open(filename, 'r') as f:
+        for line in f:
+            items.append(line.strip('\n'))
+    return items
+
+def insideDirectory(path, directory):
+    """
+    Check whether path is directory or somewhere below it.
+    """
+
+    path, directory = os.path.realpath(path), os.path.realpath(directory)
+    return os.path.commonpath([path, directory]) == directory
+
+def existingDays(conn, start, end):
+    """
+    Find the days between start and end that already have a table in the database.
+
+    Returns:
+        (list) - the days in format yyyymmdd.
+    """
+
+    first, last = start.strftime('%Y%m%d'), end.strftime('%Y%m%d')
+
+    cursor = conn.cursor()
+    cursor.execute("SHOW TABLES IN hindsight_asos;")
+    days = list()
+    for r in cursor.fetchall():
+        name = r[0]
+        if name.startswith('asos_') and name[5:].isdigit() and first <= name[5:] <= last:
+            days.append(name[5:])
+    cursor.close()
+    return sorted(days)
+
+def backfillWorker(manifest_dir, options):
+    """
+    Work through the shards of a backfill. Shards that are uploaded or locked by another worker
+    are passed over. A shard that fails keeps its last checkpoint and is retried by the next run.
+
+    Parameters:
+        manifest_dir (String) - the manifest directory.
+        options (dict) - the settings of the backfill, see ISD_Backfill.
+    Returns:
+        (int) - the number of shards this worker uploaded.
+    """
+
+    manifest = Manifest(manifest_dir)
+    existing = set(manifest.load()['info'].get('existing_days', []))
+    conn = None
+    uploaded = 0
+
+    try:
+        for shard in manifest.shards():
+            if manifest.state(shard)['state'] == 'uploaded':
+                continue
+            lock = manifest.lock(shard, options['lock_timeout'])
+            if lock is None:
+                continue
+            try:
+
+                # Check again now that we hold the lock, another worker may have just finished it.
+
+                if manifest.state(shard)['state'] == 'uploaded':
+                    continue
+                if conn is None:
+                    conn = connectHindsight()
+                if runShard(manifest, shard, lock, options, existing, conn):
+                    uploaded += 1
+            except Exception as e:
+                print('Shard %s failed: %s' % (shard.id, e))
+                manifest.checkpoint(shard, manifest.state(shard)['state'], error=str(e))
+            finally:
+                lock.release()
+    finally:
+        if conn is not None:
+            conn.close()
+
+    return uploaded
+
+def runShard(manifest, shard, lock, options, existing, conn):
+    """
+    Take one shard from its last checkpoint to uploaded. Call only while holding its lock.
+
+    Returns:
+        (Boolean) - True if the shard is uploaded, False if some of its days failed to upload.
+    """
+
+    savedir = options['savedir']
+    bounds = options['bounds']
+    start = datetime.strptime(shard.start, DATE_FMT)
+    end = datetime.strptime(shard.end, DATE_FMT)
+    metrics = RunMetrics()
+    workdir = manifest.workdir(shard)
+
+    # The files around the shard are needed too, to organize precip at its edges.
+
+    first = max(bounds[0], start - BOUNDS_PAD)
+    last = min(bounds[1], end + BOUNDS_PAD)
+
+    state = manifest.state(shard)['state']
+    print('Shard %s (%s to %s) is %s.' % (shard.id, shard.start, shard.end, state))
+
+    if state == 'pending':
+        index = fetchISD(savedir, shard.stations, first, last, options['baseurl'], options['download_workers'], 3,
+                         True, False, metrics)
+        files = stationFiles(savedir, ISDfilename(index, shard.stations, first, last))
+        manifest.checkpoint(shard, 'downloaded', files=len(files))
+        lock.refresh()
+        state = 'downloaded'
+
+    if state == 'downloaded':
+        if os.path.exists(workdir):
+            shutil.rmtree(workdir)
+        os.makedirs(workdir)
+
+        filenames = list()
+        if manifest.state(shard).get('files', 0) > 0:
+            df = processISDLite(savedir, shard.stations, list(options['variables']), shard.start, shard.end,
+                                baseurl=options['baseurl'], workers=options['download_workers'],
+                                compact=options['compact'], cache=options['cache'], metrics=metrics, bounds=bounds)
+            convertISD(df, options['variables'])
+            filenames = writeDays(df, start, end, workdir, float_format=options['float_format'], metrics=metrics)
+
+        # Days whose tables were there before the backfill started are not uploaded.
+
+        skipped = [file for file in filenames if os.path.basename(file)[:8] in existing]
+        for file in skipped:
+            os.remove(file)
+        manifest.checkpoint(shard, 'processed', days=[os.path.basename(file) for file in filenames if file not in skipped],
+                            skipped=len(skipped))
+        lock.refresh()
+        state = 'processed'
+
+    # Upload what is left in the work directory. Days loaded by an earlier attempt were removed
+    # from it then, so only the rest is uploaded again. Waiting for the other shards' uploads and
+    # uploading can both take longer than the lock timeout, so the shard lock and the upload lock
+    # are refreshed well within it the whole time.
+
+    remaining = [workdir + day for day in manifest.state(shard)['days'] if os.path.exists(workdir + day)]
+    with LockHeartbeat([lock], options['lock_timeout'] / 4) as heartbeat:
+        uploadLock = waitForLock(os.path.join(manifest.directory, 'locks', 'upload.lock'), options['lock_timeout'])
+        heartbeat.add(uploadLock)
+        try:
+            failed = uploadISD(workdir, True, True, conn=conn, metrics=metrics, filelist=remaining,
+                               workers=options['upload_workers'], batch_days=options['batch_days'])
+        finally:
+            heartbeat.discard(uploadLock)
+            uploadLock.release()
+
+    stages = metrics.report()['stages']
+    if len(failed) > 0:
+        manifest.checkpoint(shard, 'processed', failed_days=failed, stages=stages)
+        return False
+
+    manifest.checkpoint(shard, 'uploaded', failed_days=[], stages=stages, error=None)
+    shutil.rmtree(workdir, ignore_errors=True)
+    return True
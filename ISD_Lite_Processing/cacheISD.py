@@ -0,0 +1,132 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+from .parseISD import parseISD
+
+# Bump this when the output of parseISD changes so old cache entries are ignored.
+
+CACHE_VERSION = 2
+
+PRECIP_COLUMNS = ('Three Hour Precip Depth', 'Six Hour Precip Depth', 'Twelve Hour Precip Depth', 'Other Precip Depth')
+
+def parsedColumns(variables):
+    """
+    Work out which parsed columns are needed to produce a list of variables.
+
+    Parameters:
+        variables (list) - the variables you are interested in, as passed to processISDLite.
+    Returns:
+        columns (list) - 'Datetime' followed by the parseISD columns the variables come from.
+    """
+
+    columns = ['Datetime']
+    for variable in variables:
+        if variable == 'Precip':
+            needed = ['One Hour Precip Depth', 'Six Hour Precip Depth']
+        elif variable in PRECIP_COLUMNS:
+            needed = ['Six Hour Precip Depth']
+        else:
+            needed = [variable]
+        for col in needed:
+            if col not in columns:
+                columns.append(col)
+    return columns
+
+def sourceSignature(filename):
+    """
+    Identify the version of an ISD file that a cache entry was made from.
+    """
+
+    stat = os.stat(filename)
+    return {'version': CACHE_VERSION, 'source': os.path.basename(filename), 'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns}
+
+def cachedParseISD(filename, cachedir, columns=None):
+    """
+    Parse an ISD file with parseISD, going through a cache of parsed station-years. Each
+    entry is a directory named after the station-year (USAF-WBAN-YEAR) holding one .npy
+    file per column and a meta.json recording the size and modification time of the file
+    it was parsed from. The entry is rebuilt whenever the source file changes.
+
+    Parameters:
+        filename (String) - the ISD file, .isd or .gz
+        cachedir (String) - the cache directory.
+        columns (list) - Default: None, the columns to load. When None every column is loaded.
+    Returns:
+        (DataFrame) - the parsed data, as parseISD returns it.
+    """
+
+    key = os.path.basename(filename).split('.')[0]
+    entry = os.path.join(cachedir, key)
+    signature = sourceSignature(filename)
+
+    meta = readMeta(entry)
+    if meta is not None and meta['signature'] == signature:
+        df = readEntry(entry, meta, columns)
+        if df is not None:
+            return df
+
+    df = parseISD(filename)
+    try:
+        writeEntry(entry, df, signature)
+    except OSError as e:
+        print('Could not cache %s: %s' % (key, e))
+
+    if columns is not None:
+        df = df[[col for col in columns if col in df.columns]]
+    return df
+
+def readEntry(entry, meta, columns=None):
+    """
+    Load the columns of a cache entry. Another process may be replacing the entry while it is
+    read, so any failure to load it is a cache miss.
+
+    Returns:
+        (DataFrame) - the cached data, or None if the entry could not be read.
+    """
+
+    if columns is None:
+        columns = meta['columns']
+    try:
+        return pd.DataFrame({col: np.load(os.path.join(entry, '%d.npy' % meta['columns'].index(col)))
+                             for col in columns if col in meta['columns']})
+    except (OSError, ValueError, EOFError):
+        return None
+
+def readMeta(entry):
+    try:
+        with open(os.path.join(entry, 'meta.json'), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def writeEntry(entry, df, signature):
+    """
+    Write a cache entry to a temporary directory and move it into place, so readers never
+    see a half written entry.
+    """
+
+    tmp = entry + '.tmp%d' % os.getpid()
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+
+    # If another process puts its entry in place first os.replace fails, so the temporary
+    # directory is always cleaned up.
+
+    try:
+        columns = df.columns.tolist()
+        for i, col in enumerate(columns):
+            np.save(os.path.join(tmp, '%d.npy' % i), df[col].to_numpy())
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump({'signature': signature, 'columns': columns}, f)
+
+        if os.path.exists(entry):
+            shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp, entry)
+    finally:
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp, ignore_errors=True)
@@ -0,0 +1,221 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+from datetime import datetime, timedelta
+from .processISDLite import DATE_FMT, processISDLiteChunks
+from .storeISD import variableColumns
+
+# xarray is only needed for toXarray, so cubes work without it.
+
+try:
+    import xarray as xr
+except ImportError:
+    xr = None
+
+HOUR = np.timedelta64(1, 'h')
+
+class ISDCube:
+    """
+    Observations on a regular hourly grid, as a dense float32 array of shape (stations, hours,
+    variables). Hours without an observation, and stations without data, are NaN.
+
+    Memory per station-year (8,760 hours) with every variable and Precip selected:
+
+        processISDLite dataframe: 104 bytes/row, about 0.91 MB, plus the ICAO strings
+        cube: 11 float32 values = 44 bytes/hour, about 0.39 MB
+
+    and the cube has no row index, so comparing stations is slicing instead of filtering.
+
+    Attributes:
+        data (ndarray or memmap) - the values, data[station, hour, variable].
+        stations (list) - the stations along the first axis, in ICAO format.
+        times (ndarray) - the datetime64 hour of each step along the second axis.
+        variables (list) - the columns along the third axis, as processISDLite names them.
+    """
+
+    def __init__(self, data, stations, times, variables):
+        self.data = data
+        self.stations = list(stations)
+        self.times = times
+        self.variables = list(variables)
+
+    def station(self, icao):
+        """
+        The (hours, variables) values of one station.
+        """
+
+        return self.data[self.stations.index(icao)]
+
+    def variable(self, name):
+        """
+        The (stations, hours) values of one variable.
+        """
+
+        return self.data[:, :, self.variables.index(name)]
+
+    def hours(self, starttime, endtime):
+        """
+        The slice along the time axis from starttime to endtime, both in format yyyymmdd_HH.
+        """
+
+        first = np.datetime64(datetime.strptime(starttime, DATE_FMT), 'h')
+        last = np.datetime64(datetime.strptime(endtime, DATE_FMT), 'h')
+        return slice(int(np.searchsorted(self.times, first)), int(np.searchsorted(self.times, last, side='right')))
+
+    def save(self, directory):
+        """
+        Save the cube as data.npy and a meta.json with the coordinates. The directory is written
+        under a temporary name and moved into place, so readers never see half of it.
+        """
+
+        tmp = directory.rstrip('/\\') + '.tmp%d' % os.getpid()
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+
+        np.save(os.path.join(tmp, 'data.npy'), self.data)
+        writeMeta(tmp, self.stations, self.times, self.variables)
+        replaceDirectory(tmp, directory)
+
+    def toXarray(self):
+        """
+        The cube as an xarray DataArray with station, time and variable coordinates.
+
+        Raises:
+            ImportError - if xarray is not installed.
+        """
+
+        if xr is None:
+            raise ImportError('toXarray needs xarray. Install it with: pip install xarray')
+        return xr.DataArray(self.data, dims=('station', 'time', 'variable'),
+                            coords={'station': self.stations, 'time': self.times.astype('datetime64[ns]'),
+                                    'variable': self.variables})
+
+def hourGrid(start, end):
+    """
+    The datetime64 hours from start to end, both datetimes on the hour.
+    """
+
+    return np.arange(np.datetime64(start, 'h'), np.datetime64(end, 'h') + HOUR, HOUR)
+
+def writeMeta(directory, stations, times, variables):
+    meta = {'stations': list(stations), 'variables': list(variables),
+            'start': pd.Timestamp(times[0]).strftime(DATE_FMT), 'hours': len(times)}
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+def replaceDirectory(tmp, directory):
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.replace(tmp, directory)
+
+def fillCube(data, df, stations, times, variables):
+    """
+    Put the observations of a dataframe into their cells of data. Rows outside the grid, or for
+    stations not in it, are left out.
+    """
+
+    if len(df) == 0:
+        return
+
+    codes = pd.Categorical(df['ICAO'].astype(str), categories=stations).codes
+    steps = (df['Datetime'].to_numpy().astype('datetime64[h]') - times[0]) // HOUR
+    keep = (codes >= 0) & (steps >= 0) & (steps < len(times))
+
+    for v, variable in enumerate(variables):
+        if variable in df.columns:
+            values = df[variable].to_numpy(dtype='float32', na_value=np.nan)
+            data[codes[keep], steps[keep], v] = values[keep]
+
+def cubeISD(df, starttime, endtime, stations=None, variables=None):
+    """
+    Convert a processISDLite dataframe to an ISDCube.
+
+    Parameters:
+        df (dataframe) - the observations, in the default or the compact schema.
+        starttime (String) - the first hour of the grid in format yyyymmdd_HH.
+        endtime (String) - the last hour of the grid in format yyyymmdd_HH.
+        stations (list) - Default: None, the stations of the cube. When None the stations in df, in
+            the order they first appear.
+        variables (list) - Default: None, the variables as passed to processISDLite. When None every
+            observation column of df.
+    Returns:
+        (ISDCube) - the observations on the hourly grid.
+    """
+
+    times = hourGrid(datetime.strptime(starttime, DATE_FMT), datetime.strptime(endtime, DATE_FMT))
+    if stations is None:
+        stations = df['ICAO'].astype(str).unique().tolist()
+    if variables is None:
+        columns = [col for col in df.columns if col not in ('Datetime', 'ICAO')]
+    else:
+        columns = variableColumns(variables)
+
+    data = np.full((len(stations), len(times), len(columns)), np.nan, dtype='float32')
+    fillCube(data, df, stations, times, columns)
+    return ISDCube(data, stations, times, columns)
+
+def processISDLiteCube(savedir, stations, variables, starttime, endtime, directory=None, chunk_days=30, **options):
+    """
+    Process ISD Lite observations straight into an ISDCube, a chunk at a time with
+    processISDLiteChunks, so the long dataframe is never held in memory. When directory is given
+    the cube is built in a memory-mapped data.npy there, so it doesn't have to fit in memory either.
+
+    Parameters:
+        directory (String) - Default: None, where to save the cube. See ISDCube.save and loadCube.
+        chunk_days (int) - Default: 30, the number of days processed at a time.
+        The other parameters are the same as for processISDLiteChunks.
+    Returns:
+        (ISDCube) - every station asked for along the first axis, the hours from starttime to
+            endtime along the second. The data is memory-mapped when directory is given.
+    """
+
+    times = hourGrid(datetime.strptime(starttime, DATE_FMT), datetime.strptime(endtime, DATE_FMT))
+    columns = variableColumns(variables)
+    shape = (len(stations), len(times), len(columns))
+
+    tmp = None
+    if directory is None:
+        data = np.full(shape, np.nan, dtype='float32')
+    else:
+        tmp = directory.rstrip('/\\') + '.tmp%d' % os.getpid()
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+        data = np.lib.format.open_memmap(os.path.join(tmp, 'data.npy'), mode='w+', dtype='float32', shape=shape)
+        data[:] = np.nan
+
+    for chunkstart, chunkend, chunkdf in processISDLiteChunks(savedir, stations, list(variables), starttime, endtime,
+                                                              chunk_days=chunk_days, **options):
+        fillCube(data, chunkdf, stations, times, columns)
+
+    if directory is None:
+        return ISDCube(data, stations, times, columns)
+
+    data.flush()
+    del data
+    writeMeta(tmp, stations, times, columns)
+    replaceDirectory(tmp, directory)
+    return loadCube(directory)
+
+def loadCube(directory, mmap=True):
+    """
+    Load a cube saved by ISDCube.save or processISDLiteCube.
+
+    Parameters:
+        directory (String) - the cube directory.
+        mmap (Boolean) - Default: True, memory-map data.npy read-only instead of reading it in.
+    Returns:
+        (ISDCube) - the cube.
+    """
+
+    with open(os.path.join(directory, 'meta.json'), 'r') as f:
+        meta = json.load(f)
+
+    data = np.load(os.path.join(directory, 'data.npy'), mmap_mode='r' if mmap else None)
+    start = datetime.strptime(meta['start'], DATE_FMT)
+    times = hourGrid(start, start + timedelta(hours=meta['hours'] - 1))
+    return ISDCube(data, meta['stations'], times, meta['variables'])
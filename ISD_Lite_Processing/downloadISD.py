@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import shutil
+import http.client
+import urllib.error
+import urllib.request
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+ISD_LITE_URL = 'https://www.ncei.noaa.gov/pub/data/noaa/isd-lite/'
+
+# HTTP status codes that are worth another attempt. Anything else (404 in particular)
+# will not get better by asking again.
+
+RETRY_STATUS = (408, 429, 500, 502, 503, 504)
+
+# Where the ETag and Last-Modified headers of downloaded files are kept, so later runs can
+# ask the server for a file only if it has changed.
+
+VALIDATOR_FILE = 'isd-lite-http.json'
+
+DownloadResult = namedtuple('DownloadResult', ['filename', 'ok', 'status', 'attempts', 'error', 'etag', 'last_modified'],
+                            defaults=(None, None))
+
+def fileURL(filename, baseurl=ISD_LITE_URL):
+    """
+    Build the URL of an ISD Lite file. Files are stored on the server in one directory per year.
+
+    Parameters:
+        filename (String) - the ISD Lite filename in format USAF-WBAN-YEAR.gz
+        baseurl (String) - the root of the ISD Lite archive or a mirror of it.
+    Returns:
+        (String) - the full URL of the file.
+    """
+
+    if not baseurl.endswith('/'):
+        baseurl = baseurl + '/'
+    idx = filename.rfind('-') + 1
+    year = filename[idx:(idx+4)]
+    return baseurl + year + '/' + filename
+
+def downloadFile(filename, savedir, baseurl=ISD_LITE_URL, retries=3, backoff=1.0, timeout=60, validators=None):
+    """
+    Download a single ISD Lite file into savedir, retrying with exponential backoff on
+    connection errors and transient server errors. The file is written to a temporary
+    name first so a failed transfer never leaves a partial file behind.
+
+    When validators from an earlier download are given the request is conditional. If the
+    file has not changed the server answers 304, nothing is downloaded and the result is
+    ok with status 304.
+
+    Parameters:
+        filename (String) - the ISD Lite filename in format USAF-WBAN-YEAR.gz
+        savedir (String) - the directory to save the file to.
+        baseurl (String) - the root of the ISD Lite archive or a mirror of it.
+        retries (int) - how many times to retry after the first failed attempt.
+        backoff (float) - seconds to wait before the first retry. Doubles every retry.
+        timeout (float) - socket timeout in seconds for each attempt.
+        validators (tuple) - Default: None, the (etag, last_modified) of the copy already in savedir.
+    Returns:
+        (DownloadResult) - the outcome of the download.
+    """
+
+    url = fileURL(filename, baseurl)
+    tmp = savedir + filename + '.part'
+    attempt = 0
+
+    headers = dict()
+    etag, last_modified = validators if validators is not None else (None, None)
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    while True:
+        attempt += 1
+        try:
+            request = urllib.request.Request(url, headers=headers)
+            with urllib.request.urlopen(request, timeout=timeout) as response, open(tmp, 'wb') as f:
+                shutil.copyfileobj(response, f)
+
+                # Reading in blocks stops quietly at the end of a truncated body, so check the
+                # length the server announced.
+
+                expected = response.headers.get('Content-Length')
+                if expected is not None and f.tell() != int(expected):
+                    raise http.client.IncompleteRead(b'', int(expected) - f.tell())
+                etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+            os.replace(tmp, savedir + filename)
+            return DownloadResult(filename, True, 200, attempt, None, etag, last_modified)
+        except urllib.error.HTTPError as e:
+            status, error = e.code, str(e)
+            if status == 304:
+                return DownloadResult(filename, True, 304, attempt, None, etag, last_modified)
+            if status not in RETRY_STATUS:
+                break
+        except (urllib.error.URLError, OSError, http.client.HTTPException) as e:
+
+            # A connection dropped part way through the body raises IncompleteRead, which is
+            # an HTTPException rather than an OSError.
+
+            status, error = None, str(e)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+        if attempt > retries:
+            break
+        time.sleep(backoff * 2 ** (attempt - 1))
+
+    return DownloadResult(filename, False, status, attempt, error)
+
+def downloadISD(filenames, savedir, baseurl=ISD_LITE_URL, workers=8, retries=3, backoff=1.0, timeout=60,
+                validators=None, on_result=None):
+    """
+    Download a list of ISD Lite files using a bounded pool of worker threads.
+
+    Parameters:
+        filenames (list) - ISD Lite filenames in format USAF-WBAN-YEAR.gz
+        savedir (String) - the directory to save the files to.
+        baseurl (String) - the root of the ISD Lite archive or a mirror of it.
+        workers (int) - the maximum number of simultaneous downloads.
+        retries (int) - how many times to retry each file after the first failed attempt.
+        backoff (float) - seconds to wait before the first retry. Doubles every retry.
+        timeout (float) - socket timeout in seconds for each attempt.
+        validators (dict) - Default: None, filename -> (etag, last_modified) for files that should
+            only be downloaded if they have changed. See loadValidators.
+        on_result (function) - Default: None, called with each DownloadResult as soon as that download
+            is done, in the calling thread. If it raises, the downloads that haven't started are 
+            cancelled and the error is raised.
+    Returns:
+        results (list) - a DownloadResult for every filename, in the order given.
+    """
+
+    if len(filenames) == 0:
+        return list()
+
+    if validators is None:
+        validators = dict()
+
+    def fetch(filename):
+        return downloadFile(filename, savedir, baseurl, retries, backoff, timeout, validators.get(filename))
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(filenames)))) as pool:
+        if on_result is None:
+            results = list(pool.map(fetch, filenames))
+        else:
+            futures = {pool.submit(fetch, filename): i for i, filename in enumerate(filenames)}
+            results = [None] * len(filenames)
+            try:
+                for future in as_completed(futures):
+                    results[futures[future]] = future.result()
+                    on_result(results[futures[future]])
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+    return results
+
+def loadValidators(savedir):
+    """
+    Load the ETag and Last-Modified headers saved for the files in savedir.
+
+    Returns:
+        (dict) - filename -> (etag, last_modified)
+    """
+
+    path = savedir + VALIDATOR_FILE
+    if not os.path.exists(path):
+        return dict()
+    with open(path, 'r') as f:
+        return {filename: tuple(v) for filename, v in json.load(f).items()}
+
+def saveValidators(savedir, validators, results):
+    """
+    Record the ETag and Last-Modified headers of freshly downloaded files next to them in savedir.
+
+    Parameters:
+        savedir (String) - the directory the files were downloaded to.
+        validators (dict) - the validators loaded with loadValidators. Updated in place.
+        results (list) - the DownloadResults of the downloads.
+    """
+
+    for result in results:
+        if result.ok and result.status == 200 and (result.etag or result.last_modified):
+            validators[result.filename] = (result.etag, result.last_modified)
+
+    tmp = savedir + VALIDATOR_FILE + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(validators, f, indent=1, sort_keys=True)
+    os.replace(tmp, savedir + VALIDATOR_FILE)
@@ -0,0 +1,173 @@
+import os
+import pandas as pd
+
+from datetime import datetime
+from .processISDLite import DATE_FMT
+from .metrics import RunMetrics
+
+# pyarrow is only needed to export to and read from Parquet, so the rest of the library works
+# without it.
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = ds = pq = None
+
+# Every partition is a single file, rewritten in one step when rows are added to it.
+
+PART_FILE = 'part-0.parquet'
+
+def requirePyarrow():
+    if pa is None:
+        raise ImportError('Parquet export needs pyarrow. Install it with: pip install pyarrow')
+
+def partitionPath(directory, year, month, station):
+    """
+    The directory of one partition, in the key=value layout query engines read partitions from.
+    """
+
+    return os.path.join(directory, 'year=%d' % year, 'month=%d' % month, 'station=%s' % station)
+
+def exportParquet(df, directory, append=True, compression='snappy', metrics=None):
+    """
+    Export processed observations, as processISDLite returns them, to a Parquet dataset partitioned
+    by year, month and station:
+
+        <directory>/year=2021/month=3/station=KRDU/part-0.parquet
+
+    The files hold the observation columns sorted by Datetime, with min/max statistics for each
+    column. ICAO is not stored in the files, it is the station partition. Only the partitions that
+    df has rows for are written, so exporting each new run only rewrites the months it touched.
+
+    Parameters:
+        df (dataframe) - the observations, in the default or the compact schema.
+        directory (String) - the root directory of the dataset.
+        append (Boolean) - Default: True, add the rows to the partitions already in the dataset. Rows
+            at a time the partition already has replace the old ones. If False the partitions df has
+            rows for are replaced, the others are left alone.
+        compression (String) - Default: 'snappy', the Parquet compression codec.
+        metrics (RunMetrics) - Default: None, records the rows, files and bytes written in the
+            export stage.
+    Returns:
+        (dict) - the number of partitions written and unchanged, and the number of rows exported.
+    """
+
+    requirePyarrow()
+
+    if metrics is None:
+        metrics = RunMetrics()
+
+    summary = {'written': 0, 'unchanged': 0, 'rows': 0}
+    if len(df) == 0:
+        return summary
+
+    times = df['Datetime']
+    stations = df['ICAO'].astype(str)
+
+    with metrics.stage('export') as counts:
+        for (year, month, station), part in df.groupby([times.dt.year, times.dt.month, stations], sort=True):
+            part = part.drop(columns='ICAO').sort_values('Datetime', kind='stable').reset_index(drop=True)
+            path = partitionPath(directory, year, month, station)
+            filename = os.path.join(path, PART_FILE)
+
+            # Keep the old rows at times the new rows don't have. If that leaves the partition as
+            # it was, it is not written again.
+
+            if append and os.path.exists(filename):
+                existing = pq.read_table(filename).to_pandas()
+                old = existing.loc[~existing['Datetime'].isin(part['Datetime'])]
+                part = pd.concat([old, part], axis=0).sort_values('Datetime', kind='stable').reset_index(drop=True)
+                if part.equals(existing):
+                    summary['unchanged'] += 1
+                    continue
+
+            counts['bytes'] += writePartition(part, path, compression)
+            counts['files'] += 1
+            counts['rows'] += len(part)
+            summary['written'] += 1
+            summary['rows'] += len(part)
+
+    print('Exported %d partitions to %s, %d unchanged.' % (summary['written'], directory, summary['unchanged']))
+
+    return summary
+
+def writePartition(part, path, compression):
+    """
+    Write a partition to a temporary file and move it into place, so readers never see a half
+    written partition.
+
+    Returns:
+        (int) - the size of the file written.
+    """
+
+    os.makedirs(path, exist_ok=True)
+    filename = os.path.join(path, PART_FILE)
+
+    # Dataset readers skip names starting with _ or ., so a temporary file left by a crashed
+    # writer is never read as part of the partition.
+
+    tmp = os.path.join(path, '_tmp-%d-%s' % (os.getpid(), PART_FILE))
+
+    table = pa.Table.from_pandas(part, preserve_index=False)
+    pq.write_table(table, tmp, compression=compression, write_statistics=True)
+    os.replace(tmp, filename)
+
+    return os.path.getsize(filename)
+
+def readParquet(directory, stations=None, starttime=None, endtime=None, columns=None):
+    """
+    Read observations back from a dataset written by exportParquet. Partitions outside the stations
+    and times asked for are not opened.
+
+    Parameters:
+        directory (String) - the root directory of the dataset.
+        stations (list) - Default: None, the stations to read. When None every station is read.
+        starttime (String) - Default: None, the first time to read, in format yyyymmdd_HH.
+        endtime (String) - Default: None, the last time to read, in format yyyymmdd_HH.
+        columns (list) - Default: None, the observation columns to read. When None every column is read.
+    Returns:
+        (dataframe) - Datetime, ICAO and the observation columns, sorted by station and time.
+    """
+
+    requirePyarrow()
+
+    dataset = ds.dataset(directory, format='parquet', partitioning='hive')
+
+    # The partition filters skip whole directories, the Datetime filters skip the row groups whose
+    # statistics are outside the window.
+
+    conditions = list()
+    if stations is not None:
+        conditions.append(ds.field('station').isin(list(stations)))
+    if starttime is not None:
+        start = datetime.strptime(starttime, DATE_FMT)
+        conditions.append((ds.field('year') > start.year) |
+                          ((ds.field('year') == start.year) & (ds.field('month') >= start.month)))
+        conditions.append(ds.field('Datetime') >= pd.Timestamp(start))
+    if endtime is not None:
+        end = datetime.strptime(endtime, DATE_FMT)
+        conditions.append((ds.field('year') < end.year) |
+                          ((ds.field('year') == end.year) & (ds.field('month') <= end.month)))
+        conditions.append(ds.field('Datetime') <= pd.Timestamp(end))
+
+    condition = None
+    for c in conditions:
+        condition = c if condition is None else condition & c
+
+    names = [name for name in dataset.schema.names if name not in ('year', 'month', 'station', 'Datetime')]
+    if columns is not None:
+        names = [name for name in names if name in columns]
+
+    df = dataset.to_table(columns=['Datetime', 'station'] + names, filter=condition).to_pandas()
+    df = df.rename(columns={'station': 'ICAO'})
+    df['ICAO'] = df['ICAO'].astype(str)
+
+    # Put the stations in the order they were asked for, like processISDLite does.
+
+    order = list(stations) if stations is not None else sorted(df['ICAO'].unique())
+    df['order'] = df['ICAO'].map({station: i for i, station in enumerate(order)})
+    df = df.sort_values(['order', 'Datetime'], kind='stable').drop(columns='order').reset_index(drop=True)
+
+    return df
@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import cProfile
+import threading
+
+from datetime import datetime
+from contextlib import contextmanager
+
+# The counters kept for every stage, besides the time spent in it.
+
+COUNTERS = ('rows', 'bytes', 'files')
+
+class RunMetrics:
+    """
+    Wall time, rows, bytes and files recorded for each stage of a run, e.g. 'download',
+    'parse' or 'insert'. A stage can be entered many times, the numbers are added up. It is
+    safe to record from several threads at once.
+
+    When profiledir is given every stage is also run under cProfile and the profiles are
+    saved as <profiledir>/<stage>.prof by writeProfiles. Only stages run in the main thread
+    of the main process are profiled.
+    """
+
+    def __init__(self, profiledir=None):
+        self.started = datetime.now()
+        self.clock = time.perf_counter()
+        self.stages = dict()
+        self.info = dict()
+        self.profiledir = profiledir
+        self.profiles = dict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def __getstate__(self):
+
+        # Locks, thread locals and profilers can't be sent to worker processes.
+
+        state = self.__dict__.copy()
+        state['lock'] = state['local'] = None
+        state['profiles'] = dict()
+        state['profiledir'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def add(self, name, seconds=0.0, calls=1, **counts):
+        """
+        Add time and counts to a stage.
+
+        Parameters:
+            name (String) - the stage.
+            seconds (float) - Default: 0.0, the time spent in the stage.
+            calls (int) - Default: 1, how many times the stage was entered.
+            counts - rows, bytes and files handled by the stage.
+        """
+
+        with self.lock:
+            stage = self.stages.setdefault(name, dict({'seconds': 0.0, 'calls': 0}, **{c: 0 for c in COUNTERS}))
+            stage['seconds'] += seconds
+            stage['calls'] += calls
+            for counter, value in counts.items():
+                stage[counter] += int(value)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a stage. Yields a dictionary of the counters in COUNTERS that the caller can fill
+        in, they are added to the stage when it ends.
+
+        Example:
+            with metrics.stage('parse') as counts:
+                df = parseISD(filename)
+                counts['rows'] = len(df)
+        """
+
+        counts = {counter: 0 for counter in COUNTERS}
+        profiler = self.startProfile(name)
+        t = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            seconds = time.perf_counter() - t
+            if profiler is not None:
+                profiler.disable()
+                self.local.profiling = False
+            self.add(name, seconds, **counts)
+
+    def startProfile(self, name):
+
+        # Only one profiler can be active at a time, so stages inside a profiled stage are part
+        # of its profile rather than getting their own. Stages in other threads aren't profiled.
+
+        if self.profiledir is None or getattr(self.local, 'profiling', False):
+            return None
+        if threading.current_thread() is not threading.main_thread():
+            return None
+        profiler = self.profiles.setdefault(name, cProfile.Profile())
+        try:
+            profiler.enable()
+        except ValueError:
+            return None
+        self.local.profiling = True
+        return profiler
+
+    def merge(self, other):
+        """
+        Add the stages recorded by another RunMetrics, e.g. one filled in by a worker process.
+        """
+
+        for name, stage in other.stages.items():
+            self.add(name, stage['seconds'], stage['calls'], **{c: stage[c] for c in COUNTERS})
+
+    def report(self):
+        """
+        The run as a dictionary: when it started, how long it has run, every stage and any
+        extra information stored in info.
+        """
+
+        with self.lock:
+            stages = {name: dict(stage) for name, stage in self.stages.items()}
+        for stage in stages.values():
+            stage['rows_per_second'] = stage['rows'] / stage['seconds'] if stage['seconds'] > 0 else 0.0
+        return {'started': self.started.isoformat(timespec='seconds'), 'seconds': time.perf_counter() - self.clock,
+                'stages': stages, 'info': self.info}
+
+    def summary(self):
+        """
+        A table of the stages for printing.
+        """
+
+        report = self.report()
+        lines = ['%-14s %10s %8s %12s %12s %8s' % ('stage', 'seconds', 'calls', 'rows', 'bytes', 'files')]
+        for name, stage in report['stages'].items():
+            lines.append('%-14s %10.3f %8d %12d %12d %8d' % (name, stage['seconds'], stage['calls'], stage['rows'],
+                                                            stage['bytes'], stage['files']))
+        lines.append('%-14s %10.3f' % ('total', report['seconds']))
+        return '\n'.join(lines)
+
+    def writeReport(self, filename):
+        """
+        Write the run report as JSON.
+        """
+
+        writeAtomic(filename, json.dumps(self.report(), indent=1, default=str))
+
+    def writePrometheus(self, filename, prefix='isd_obs'):
+        """
+        Write the run in the Prometheus text format, for the node_exporter textfile collector.
+        Every stage counter is a gauge labelled with the stage.
+
+        Parameters:
+            filename (String) - the .prom file to write.
+            prefix (String) - Default: 'isd_obs', the prefix of the metric names.
+        """
+
+        report = self.report()
+        lines = list()
+
+        def gauge(name, help, samples):
+            lines.append('# HELP %s_%s %s' % (prefix, name, help))
+            lines.append('# TYPE %s_%s gauge' % (prefix, name))
+            for labels, value in samples:
+                lines.append('%s_%s%s %s' % (prefix, name, labels, repr(float(value))))
+
+        stages = report['stages'].items()
+        gauge('stage_seconds', 'Wall time spent in each stage of the last run.',
+              [('{stage="%s"}' % name, stage['seconds']) for name, stage in stages])
+        gauge('stage_calls', 'Times each stage was entered in the last run.',
+              [('{stage="%s"}' % name, stage['calls']) for name, stage in stages])
+        for counter in COUNTERS:
+            gauge('stage_%s' % counter, 'The %s handled by each stage of the last run.' % counter,
+                  [('{stage="%s"}' % name, stage[counter]) for name, stage in stages])
+        gauge('run_seconds', 'Wall time of the last run.', [('', report['seconds'])])
+        gauge('run_start_timestamp_seconds', 'When the last run started.', [('', self.started.timestamp())])
+
+        writeAtomic(filename, '\n'.join(lines) + '\n')
+
+    def writeProfiles(self):
+        """
+        Save the cProfile data of every stage to <profiledir>/<stage>.prof. Load them with pstats.
+        """
+
+        if self.profiledir is None:
+            return
+        if not os.path.exists(self.profiledir):
+            os.makedirs(self.profiledir)
+        for name, profiler in self.profiles.items():
+            profiler.dump_stats(os.path.join(self.profiledir, name + '.prof'))
+
+def writeAtomic(filename, text):
+    """
+    Write a file in one step so readers never see it half written.
+    """
+
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, filename)
@@ -4,122 +4,70 @@
 # Date: 05/19/2022
 # ========================================
 
-import math
-from numpy import NaN
+import numpy as np
 
 
+def precipGaps(values):
+    """
+    Find every reported value in a precip column and the gap, in rows, that decides
+    what kind of accumulation it is. The gap is the distance back to the previous
+    report. For the first row, or when the previous report is more than 12 rows back,
+    the distance forward to the next report is used instead. If there is no next
+    report the end of the column counts as the next report.
+
+    Parameters:
+        values (ndarray) - the six hour precip column, NaN where nothing was reported.
+    Returns:
+        idx (ndarray) - the positions of the reported values.
+        gap (ndarray) - the gap for each reported value.
+    """
+
+    n = len(values)
+    idx = np.flatnonzero(~np.isnan(values))
+    prev = np.r_[-1, idx][:-1]
+    nxt = np.r_[idx, n][1:]
+
+    back = idx - prev
+    forward = nxt - idx
+    gap = np.where((idx == 0) | (back > 12), forward, back)
+
+    return idx, gap
+
 def organizePrecip(df):
 
     """
-    Organize precip according to 3hr, 6hr, and 12hr values. Attach these 
-    to the end of the passed dataframe. 
+    Organize precip according to 3hr, 6hr, and 12hr values. Attach these
+    to the end of the passed dataframe.
+
+    Values reported 3 rows after the previous report are 3hr values, 6 rows are 6hr
+    values and 12 rows are 12hr values. Everything else is moved to 'Other Precip Depth'.
+    Only the 6hr values are left in 'Six Hour Precip Depth'.
 
     Parameters:
         df (dataframe) - the dataframe to be organized and modified.
     Returns:
-        df (dataframe) - the modified dataframe. 
+        df (dataframe) - the modified dataframe.
     """
 
-    precip3hr = list()
-    precip12hr = list()
-    precipOther = list()
-
-    cnt = 0
-    for i in range(len(df)):
-
-        # Determine what kind of varible is the first value in dataframe. 
-
-        if i == 0 and not math.isnan(df.loc[i, 'Six Hour Precip Depth']):
-            j = 1
-            while math.isnan(df.loc[j, 'Six Hour Precip Depth']) and j < len(df):
-                j += 1
-                if j == len(df):
-                    break
-            if j == 3:
-                precip3hr.append(df.loc[i, 'Six Hour Precip Depth'])
-                precip12hr.append(NaN)
-                precipOther.append(NaN)
-                df.loc[i, 'Six Hour Precip Depth'] = NaN
-            elif j == 6:
-                precip3hr.append(NaN)
-                precip12hr.append(NaN)
-                precipOther.append(NaN)
-            elif j == 12:
-                precip12hr.append(df.loc[i, 'Six Hour Precip Depth'])
-                precip3hr.append(NaN)
-                precipOther.append(NaN)
-                df.loc[i, 'Six Hour Precip Depth'] = NaN
-            else:
-                precip3hr.append(NaN)
-                precip12hr.append(NaN)
-                precipOther.append(df.loc[i, 'Six Hour Precip Depth'])
-                df.loc[i, 'Six Hour Precip Depth'] = NaN
-        
-        # Determine what kind of variable the value is based on the value of the counter. 
-
-        elif not math.isnan(df.loc[i, 'Six Hour Precip Depth']) and (cnt <=11) and i > 0:
-            if cnt == 2:
-                precip3hr.append(df.loc[i, 'Six Hour Precip Depth'])
-                precip12hr.append(NaN)
-                precipOther.append(NaN)
-                df.loc[i, 'Six Hour Precip Depth'] = NaN
-            elif cnt == 5:
-                precip3hr.append(NaN)
-                precip12hr.append(NaN)
-                precipOther.append(NaN)
-            elif cnt == 11:
-                precip12hr.append(df.loc[i, 'Six Hour Precip Depth'])
-                precip3hr.append(NaN)
-                precipOther.append(NaN)
-                df.loc[i, 'Six Hour Precip Depth'] = NaN
-            else:
-                precip3hr.append(NaN)
-                precip12hr.append(NaN)
-                precipOther.append(df.loc[i, 'Six Hour Precip Depth'])
-                df.loc[i, 'Six Hour Precip Depth'] = NaN
-            cnt = 0
-
-        # Determine what kind of variable something is if the counter is higher than 11.
-        # In this case we use the count forward method to make the determination.
-
-        elif not math.isnan(df.loc[i, 'Six Hour Precip Depth']) and (cnt > 11) and i > 0:
-            j = i + 1
-            while math.isnan(df.loc[j, 'Six Hour Precip Depth']) and j < len(df):
-                j += 1
-                if j == len(df):
-                    break
-            if j == i + 3:
-                precip3hr.append(df.loc[i, 'Six Hour Precip Depth'])
-                precip12hr.append(NaN)
-                precipOther.append(NaN)
-                df.loc[i, 'Six Hour Precip Depth'] = NaN
-            elif j == i + 6:
-                precip3hr.append(NaN)
-                precip12hr.append(NaN)
-                precipOther.append(NaN)
-            elif j == i + 12:
-                precip3hr.append(NaN)
-                precip12hr.append(df.loc[i, 'Six Hour Precip Depth'])
-                precipOther.append(NaN)
-                df.loc[i, 'Six Hour Precip Depth'] = NaN
-            else:
-                precip3hr.append(NaN)
-                precip12hr.append(NaN)
-                precipOther.append(df.loc[i, 'Six Hour Precip Depth'])
-                df.loc[i, 'Six Hour Precip Depth'] = NaN
-            cnt = 0
-        
-        # We didn't find a value so append nans to our lists and increment the counter. 
-
-        else:
-            precip3hr.append(NaN)
-            precip12hr.append(NaN)
-            precipOther.append(NaN)
-            cnt += 1
-    
-    df.insert(8, 'Three Hour Precip Depth', precip3hr, True)
+    six = df['Six Hour Precip Depth'].to_numpy(dtype='float64', copy=True)
+    idx, gap = precipGaps(six)
+    vals = six[idx]
+
+    precip3hr = np.full(len(six), np.nan)
+    precip12hr = np.full(len(six), np.nan)
+    precipOther = np.full(len(six), np.nan)
+
+    is3hr = gap == 3
+    is12hr = gap == 12
+    isOther = ~(is3hr | is12hr | (gap == 6))
+
+    precip3hr[idx[is3hr]] = vals[is3hr]
+    precip12hr[idx[is12hr]] = vals[is12hr]
+    precipOther[idx[isOther]] = vals[isOther]
+    six[idx[gap != 6]] = np.nan
+
+    df['Six Hour Precip Depth'] = six
+    df.insert(df.columns.get_loc('Six Hour Precip Depth'), 'Three Hour Precip Depth', precip3hr, True)
     df['Twelve Hour Precip Depth'] = precip12hr
     df['Other Precip Depth'] = precipOther
     return df
-
-        
\ No newline at end of file
@@ -1,33 +1,117 @@
+import numpy as np
 import pandas as pd
 
-def parseISD(filename):
-    
+from .windowISD import readISD, windowOffsets
+
+HEADINGS = ['Year', 'Month', 'Day', 'Hour', 'Air Temperature', 'Dew Point Temperature',
+            'Sea Level Pressure', 'Wind Direction', 'Wind Speed Rate', 'Sky Condition Code',
+            'One Hour Precip Depth', 'Six Hour Precip Depth']
+
+# Field widths of the fixed-width records. We need to specify these as inferring them from the data
+# does not correctly pick up rarely seen missing data values.
+
+WIDTHS = [5, 3, 3, 3, 6, 6, 6, 6, 6, 6, 6, 6]
+
+# Values are stored as integers in tenths, except wind direction (degrees) and the sky code.
+
+SCALES = np.array([10, 10, 10, 1, 10, 1, 10, 10], dtype='float64')
+
+MISSING = -9999
+
+def parseISD(filename, start=None, end=None):
+
     """
     Process a corresponding ISD data file and format into a Pandas dataframe.\
      Values of -9999 are interpreted as missing values.\
-     Each datapoint is scaled accordingly.
-     
+     Each datapoint is scaled accordingly.\
+     Compressed .gz files are decompressed on the fly, nothing is written to disk.\
+     When a start or end time is given only the records in that window are decoded. They
+     are found with a binary search over the file, so the rest of the year is never parsed.
+
     Parameters:
-        filename (String) - The filename of the file to be parsed.
+        filename (String) - The filename of the file to be parsed, either .isd or .gz
+        start (datetime) - Default: None, the first time of interest.
+        end (datetime) - Default: None, the last time of interest.
     Returns:
         (DataFrame) - A DataFrame containing all of the parsed and adjusted data.
     """
-    
-    headings = ['Year', 'Month', 'Day', 'Hour', 'Air Temperature', 'Dew Point Temperature',
-                                 'Sea Level Pressure', 'Wind Direction', 'Wind Speed Rate', 'Sky Condition Code',
-                                 'One Hour Precip Depth', 'Six Hour Precip Depth']
-    
-    # We need to specify the widths as the default colspec 'infer' does not correctly pick up rarely seen missing data values. 
 
-    widths = [5, 3, 3, 3, 6, 6, 6, 6, 6, 6, 6, 6]
+    buf = readISD(filename)
+    lo, hi = windowOffsets(buf, start, end)
+    data = bytes(buf[lo:hi])
+    if hasattr(buf, 'close'):
+        buf.close()
+
+    return decodeISD(data)
+
+def decodeISD(data):
+    """
+    Decode ISD Lite records into a dataframe. The records are read as a fixed-width
+    array of bytes, every field of every record is converted at once, and all of the
+    scale factors are applied in one step. All of the measurement columns are float64,
+    with NaN for missing values.
+
+    Parameters:
+        data (bytes) - the records, one per line.
+    Returns:
+        (DataFrame) - the same dataframe parseISD returns.
+    """
 
-    df = pd.read_fwf(filename, names=headings, header=None, widths=widths, parse_dates = {'Datetime' : ['Year', 'Month', 'Day', 'Hour']}, na_values=[-9999])
+    # Terminate the last line so every line ends in a newline, then find where each line 
+    # starts and how long it is. Blank lines are skipped.
 
-    df['Air Temperature'] = df['Air Temperature']/10
-    df['Dew Point Temperature'] = df['Dew Point Temperature']/10
-    df['Sea Level Pressure'] = df['Sea Level Pressure']/10
-    df['Wind Speed Rate'] = df['Wind Speed Rate']/10
-    df['One Hour Precip Depth'] = df['One Hour Precip Depth']/10
-    df['Six Hour Precip Depth'] = df['Six Hour Precip Depth']/10
+    buf = np.frombuffer(data + b'\n', dtype=np.uint8)
+    ends = np.flatnonzero(buf == ord('\n'))
+    starts = np.r_[0, ends[:-1] + 1]
+    lengths = ends - starts
+    blank = ~np.any(lineChars(buf, starts, lengths, 0, sum(WIDTHS)) > ord(' '), axis=1)
+    starts, lengths = starts[~blank], lengths[~blank]
+
+    fields = list()
+    offset = 0
+    for width in WIDTHS:
+        fields.append(decodeField(lineChars(buf, starts, lengths, offset, width)))
+        offset += width
+
+    year, month, day, hour = fields[:4]
+    values = np.column_stack(fields[4:])
+    values[values == MISSING] = np.nan
+    values = values / SCALES
+
+    # Build the timestamps arithmetically: months since 1970, then days, then hours.
+
+    months = ((year - 1970) * 12 + (month - 1)).astype('int64').astype('datetime64[M]')
+    times = (months.astype('datetime64[D]') + (day - 1).astype('int64')).astype('datetime64[ns]')
+    times = times + (hour.astype('int64') * 3600 * 10**9).astype('timedelta64[ns]')
+
+    df = pd.DataFrame(values, columns=HEADINGS[4:])
+    df.insert(0, 'Datetime', times)
 
     return df
+
+def lineChars(buf, starts, lengths, offset, width):
+    """
+    Gather the bytes of one fixed-width field from every line into a (lines, width) array.
+    Parts of the field past the end of a line are read as spaces.
+    """
+
+    cols = offset + np.arange(width)
+    idx = np.minimum(starts[:, None] + cols, len(buf) - 1)
+    return np.where(cols < lengths[:, None], buf[idx], ord(' '))
+
+def decodeField(chars):
+    """
+    Convert a (lines, width) array of right-justified integer fields to float64. Empty
+    fields are NaN.
+    """
+
+    digits = chars.astype('int64') - ord('0')
+    isDigit = (digits >= 0) & (digits <= 9)
+
+    value = np.zeros(len(chars), dtype='int64')
+    for j in range(chars.shape[1]):
+        value = np.where(isDigit[:, j], value * 10 + digits[:, j], value)
+
+    value = np.where(np.any(chars == ord('-'), axis=1), -value, value).astype('float64')
+    value[~np.any(isDigit, axis=1)] = np.nan
+    return value
@@ -0,0 +1,141 @@
+import queue
+import threading
+
+# How often, in seconds, a stage waiting on a queue checks whether the pipeline has stopped.
+
+POLL = 0.1
+
+# Put on a queue after the last item, once every worker of the stage feeding it is done.
+
+END = object()
+
+class Stopped(Exception):
+    """
+    Raised in a stage that tries to use a queue after the pipeline has stopped because
+    another stage failed.
+    """
+
+class Pipeline:
+    """
+    Stages that run at the same time, each in its own threads, passing items to each other
+    through bounded queues. A stage waits when the queue after it is full, so no stage gets
+    more than the depth of its queue ahead of the next one.
+
+    If a stage raises, the pipeline stops. Every other stage finishes what it is doing and
+    ends at its next get or put. run waits for all of them and then raises the error.
+
+    Example:
+        pipe = Pipeline()
+        numbers = pipe.queue(4)
+        pipe.stage('count', lambda: [pipe.put(numbers, n) for n in range(10)], output=numbers)
+        pipe.stage('print', lambda: [print(n) for n in pipe.items(numbers)])
+        pipe.run()
+    """
+
+    def __init__(self):
+        self.stopped = threading.Event()
+        self.errors = list()
+        self.stages = list()
+
+    def queue(self, depth):
+        """
+        A queue between two stages that holds at most depth items.
+        """
+
+        return queue.Queue(maxsize=max(1, depth))
+
+    def stage(self, name, work, output=None, workers=1):
+        """
+        Add a stage. The stage runs work() in each of its workers. work reads its input with
+        items and passes its results on with put.
+
+        Parameters:
+            name (String) - the stage name, used in error messages.
+            work (function) - the stage's work, called without arguments.
+            output (Queue) - Default: None, the queue the stage puts its results on. END is put
+                on it when every worker is done.
+            workers (int) - Default: 1, the number of threads running work at the same time.
+        """
+
+        self.stages.append((name, work, output, max(1, workers)))
+
+    def put(self, q, item):
+        """
+        Put an item on a queue, waiting for room.
+
+        Raises:
+            Stopped - if the pipeline stops while waiting.
+        """
+
+        while not self.stopped.is_set():
+            try:
+                q.put(item, timeout=POLL)
+                return
+            except queue.Full:
+                pass
+        raise Stopped()
+
+    def items(self, q):
+        """
+        The items on a queue, until END. Several workers can read the same queue.
+
+        Raises:
+            Stopped - if the pipeline stops while waiting.
+        """
+
+        while not self.stopped.is_set():
+            try:
+                item = q.get(timeout=POLL)
+            except queue.Empty:
+                continue
+            if item is END:
+
+                # Leave END on the queue for the other workers reading it.
+
+                q.put(END)
+                return
+            yield item
+        raise Stopped()
+
+    def run(self):
+        """
+        Run every stage and wait for all of them to finish.
+
+        Raises:
+            the first error raised by a stage.
+        """
+
+        threads = list()
+        for name, work, output, workers in self.stages:
+            remaining = [workers, threading.Lock()]
+            for i in range(workers):
+                thread = threading.Thread(target=self.runWorker, args=(name, work, output, remaining),
+                                          name='%s-%d' % (name, i), daemon=True)
+                threads.append(thread)
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if len(self.errors) > 0:
+            raise self.errors[0]
+
+    def runWorker(self, name, work, output, remaining):
+        try:
+            work()
+        except Stopped:
+            pass
+        except BaseException as e:
+            print('The %s stage failed, stopping: %s' % (name, e))
+            self.errors.append(e)
+            self.stopped.set()
+        finally:
+            with remaining[1]:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last and output is not None:
+                try:
+                    self.put(output, END)
+                except Stopped:
+                    pass
@@ -0,0 +1,143 @@
+import os
+import json
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+from .ISDfilename import ISDfilename
+
+# Files the server answered 404 for are kept in savedir so they aren't requested again until
+# the entry expires. Current year files are never remembered, they can appear at any time.
+
+MISSING_FILE = 'isd-lite-missing.json'
+
+MISSING_TTL = timedelta(days=30)
+
+# A station whose period of record ends this close to the newest END in isd-history.txt was
+# still reporting when the history was written, so it is assumed to be reporting since.
+
+ACTIVE_SLACK = timedelta(days=30)
+
+DownloadPlan = namedtuple('DownloadPlan', ['files', 'fetch', 'present', 'outside', 'missing'])
+DownloadPlan.__doc__ = """
+The station-year files for a request, sorted into what can be used and what is skipped.
+
+    files (list) - every file that can exist, in station and year order. This is what gets processed.
+    fetch (list) - the files in files that are not in savedir yet.
+    present (list) - the files in files that are already in savedir.
+    outside (list) - files skipped because the year is outside the station's period of record.
+    missing (list) - files skipped because the server recently answered 404 for them.
+"""
+
+def inPeriod(record, year, asof):
+    """
+    Check whether a station record was reporting during a year.
+
+    Parameters:
+        record (StationRecord) - the station record.
+        year (int) - the year.
+        asof (int) - the newest END in the station history, yyyymmdd. Records ending close to it
+            are treated as still open.
+    Returns:
+        (Boolean) - True if the year overlaps the period of record.
+    """
+
+    if year < record.BEGIN // 10000:
+        return False
+    active = datetime.strptime(str(asof), '%Y%m%d') - datetime.strptime(str(record.END), '%Y%m%d') <= ACTIVE_SLACK
+    return active or year <= record.END // 10000
+
+def planDownloads(index, stations, start, end, savedir, missing=None):
+    """
+    Work out which station-year files a request needs. Years outside a station's period of
+    record in isd-history.txt and files known to be missing on the server are left out, so
+    no request is made for them.
+
+    Parameters:
+        index (StationIndex) - the station index, see loadStationIndex.
+        stations (list) - the stations in ICAO format.
+        start (datetime) - the first time of interest.
+        end (datetime) - the last time of interest.
+        savedir (String) - the directory the files are downloaded to.
+        missing (dict) - Default: None, the known missing files, see loadMissing.
+    Returns:
+        (DownloadPlan) - the plan.
+    """
+
+    if missing is None:
+        missing = dict()
+
+    asof = index.asof()
+    plan = DownloadPlan(list(), list(), list(), list(), list())
+    for callsign in stations:
+        if callsign not in index:
+            continue
+
+        # The names come from ISDfilename, so the plan lists exactly the files that get fetched.
+
+        files = ISDfilename(index, [callsign], start, end)
+        for year, file in zip(range(start.year, end.year + 1), files):
+            record = index.lookup(callsign, year)
+            if not inPeriod(record, year, asof):
+                plan.outside.append(file)
+            elif file in missing:
+                plan.missing.append(file)
+            else:
+                plan.files.append(file)
+                if os.path.exists(savedir + file) or os.path.exists(savedir + file.replace('.gz', '.isd')):
+                    plan.present.append(file)
+                else:
+                    plan.fetch.append(file)
+
+    return plan
+
+def describePlan(plan):
+    """
+    A one line summary of a DownloadPlan with its expected file counts.
+    """
+
+    return ('%d station-year files expected: %d already downloaded, %d to download. Skipped %d outside the period '
+            'of record and %d known missing.' % (len(plan.files), len(plan.present), len(plan.fetch),
+                                                  len(plan.outside), len(plan.missing)))
+
+def loadMissing(savedir, ttl=MISSING_TTL):
+    """
+    Load the files the server recently answered 404 for. Entries older than ttl are dropped.
+
+    Parameters:
+        savedir (String) - the directory the files are downloaded to.
+        ttl (timedelta) - Default: MISSING_TTL, how long a 404 is remembered.
+    Returns:
+        (dict) - filename -> the date of the 404 in format yyyy-mm-dd.
+    """
+
+    path = savedir + MISSING_FILE
+    if not os.path.exists(path):
+        return dict()
+    with open(path, 'r') as f:
+        missing = json.load(f)
+    oldest = (datetime.utcnow() - ttl).strftime('%Y-%m-%d')
+    return {filename: seen for filename, seen in missing.items() if seen >= oldest}
+
+def saveMissing(savedir, missing, results):
+    """
+    Remember the files the server answered 404 for, except current year files, and forget
+    the ones that have been downloaded since.
+
+    Parameters:
+        savedir (String) - the directory the files were downloaded to.
+        missing (dict) - the known missing files loaded with loadMissing. Updated in place.
+        results (list) - the DownloadResults of the downloads.
+    """
+
+    today = datetime.utcnow()
+    current = (today - timedelta(days=7)).year
+    for result in results:
+        if result.ok:
+            missing.pop(result.filename, None)
+        elif result.status == 404 and int(result.filename[-7:-3]) < current:
+            missing[result.filename] = today.strftime('%Y-%m-%d')
+
+    tmp = savedir + MISSING_FILE + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(missing, f, indent=1, sort_keys=True)
+    os.replace(tmp, savedir + MISSING_FILE)
@@ -6,20 +6,37 @@
 
 import os
 import gzip 
+import time
 import shutil
-import urllib.request
 import pandas as pd
 
-from .parseISD import parseISD
+from .parseISD import parseISD, decodeISD
+from .downloadISD import ISD_LITE_URL, downloadISD, loadValidators, saveValidators
 from .ISDfilename import ISDfilename
+from .planISD import planDownloads, describePlan, loadMissing, saveMissing
+from .stationIndex import loadStationIndex
 from .organizePrecip import organizePrecip
 from .ISDvariablesort import ISDvariablesort
-from glob import glob
-from datetime import datetime
+from .compactISD import compactISD
+from .cacheISD import cachedParseISD, parsedColumns
+from .metrics import RunMetrics
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
 
 DATE_FMT = '%Y%m%d_%H'
 
-def processISDLite(savedir, stations, variables, starttime, endtime):
+# How many observations organizePrecip looks back or ahead of a report to sort it, see precipGaps.
+
+PRECIP_CONTEXT = 12
+
+# How far around a window that is part of a larger request files are fetched, so there are
+# observations to organize precip with at its edges.
+
+BOUNDS_PAD = timedelta(days=31)
+
+def processISDLite(savedir, stations, variables, starttime, endtime, baseurl=ISD_LITE_URL, workers=8, retries=3, keep_gz=True,
+                   processes=1, compact=False, refresh_current=False, after=None,
+                   cache=False, metrics=None, bounds=None):
     """
     Processes information contained in ISD Lite weather observations and outputs them into a 
     dataframe. The function takes a save directory, a list of stations, a list of variables, 
@@ -31,86 +48,560 @@ def processISDLite(savedir, stations, variables, starttime, endtime):
         variables (list) - the variables you are interested in.
         starttime (String) - a start time in format yyyymmdd_HH.
         endtime (String) - an end time in format yyyymmdd_HH.
+        baseurl (String) - Default: the NCEI ISD Lite archive, the root URL to download files from. 
+        workers (int) - Default: 8, the maximum number of simultaneous downloads.
+        retries (int) - Default: 3, how many times a failed download is retried.
+        keep_gz (Boolean) - Default: True, keep only the compressed .gz files in savedir and read them
+            directly. If False the files are unpacked to .isd and the .gz is removed.
+        processes (int) - Default: 1, the number of worker processes used to parse stations. Scripts
+            that use more than one process must call processISDLite from under if __name__ == '__main__'.
+        compact (Boolean) - Default: False, return the dataframe in the compact schema (categorical ICAO,
+            float32 measurements, Int16 wind direction and Int8 sky code). See compactISD.
+        refresh_current (Boolean) - Default: False, check files for the current year that are already in 
+            savedir for updates. They are downloaded again only if they changed on the server.
+        after (dict) - Default: None, ICAO -> datetime. Only observations after a station's time are 
+            returned. Precip is still organized using the earlier observations.
+        cache (Boolean or String) - Default: False, keep parsed station-years in a cache so later runs don't 
+            parse them again. True keeps the cache in savedir/cache/, a string names the cache directory.
+        metrics (RunMetrics) - Default: None, records the time, rows, bytes and files of the download, 
+            decompress, parse and precip stages. See metrics.
+        bounds (tuple) - Default: None, the (start, end) datetimes of a larger request that this window is 
+            part of. Precip is organized using the observations around the window, within bounds, as 
+            it would be if the whole of bounds was processed at once. 
     Returns:
         finaldf (Dataframe) - the output dataframe
     """
 
     start = datetime.strptime(starttime, DATE_FMT)
     end = datetime.strptime(endtime, DATE_FMT)
-    
-    isdListFile = './isd-history.txt'
-    headings = ['USAF', 'WBAN', 'STATION NAME', 'CTRY', 'ST', 'CALL', 'LAT', 'LON', 'ELEV', 'BEGIN', 'END']
-    widths = [7, 6, 30, 5, 3, 5, 8, 9, 8, 9, 9]
 
-    df = pd.read_fwf(isdListFile, names=headings, header=None, widths=widths,
-                     converters={headings[0]: str, headings[1]: str})
+    if metrics is None:
+        metrics = RunMetrics()
 
-    # Get a list of filenames from stations, start, and end dates. Download and
-    # unpack these files into a passed save directory (savedir). 
+    # Observations around the window are needed to organize precip when it is part of a larger
+    # request, so fetch the files around it too.
 
-    print('Downloading necessary data files.')
-
-    filenames = ISDfilename(df, stations, start, end)
-
-    if not os.path.exists(savedir):
-        os.makedirs(savedir)
+    first, last = start, end
+    if bounds is not None:
+        first = max(bounds[0], start - BOUNDS_PAD)
+        last = min(bounds[1], end + BOUNDS_PAD)
 
-    for file in filenames:
-        tmp = file.replace('.gz', '.isd')
-        if not os.path.exists(savedir + tmp):
-            download(file, savedir)
-            unpack(file, savedir)
-    
-    print('Complete!')
+    index = fetchISD(savedir, stations, first, last, baseurl, workers, retries, keep_gz, refresh_current, metrics)
 
     print('Processing each station. Please wait.')
 
-    dflist = list()
+    cachedir = cacheDirectory(savedir, cache)
 
+    jobs = list()
     for station in stations:
-        dataseg = df.loc[df['CALL'] == station].USAF
-        dataseg2 = df.loc[df['CALL'] == station].WBAN
-        if dataseg.values.any():
-            searchStr = dataseg.values[0] + '-' + dataseg2.values[0]
-            filelist = glob(savedir + searchStr + '*.isd')
-            filelist.sort()
+        if station in index:
+            filelist = stationFiles(savedir, ISDfilename(index, [station], first, last))
             if len(filelist) > 0:
-                stationdf = parseISD(filelist[0])
-            else:
-                continue
-            cnt = 1
-            while cnt < len(filelist):
-                newdf = parseISD(filelist[cnt])
-                stationdf = pd.concat([stationdf, newdf], axis=0)
-                cnt += 1
-
-            stationdf = stationdf.loc[(stationdf['Datetime'] >= start) & (stationdf['Datetime'] <= end)]
-            stationdf.reset_index(inplace=True, drop=True)
-            stationdf = organizePrecip(stationdf)
-            stationdf.insert(1, 'ICAO', station)
-            dflist.append(stationdf)
+                since = after.get(station) if after is not None else None
+                jobs.append((station, filelist, list(variables), start, end, stations if compact else None, since,
+                             cachedir, bounds))
+
+    if processes > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(processes, len(jobs))) as pool:
+            dflist = runStations(jobs, metrics, pool)
+    else:
+        dflist = runStations(jobs, metrics)
     
     print('Generating final dataframe...')
 
-    finaldf = ISDvariablesort(dflist[0], variables)
-    cnt = 1
-    while cnt < len(dflist):
-        temp = ISDvariablesort(dflist[cnt], variables)
-        finaldf = pd.concat([finaldf, temp], axis=0)
-        cnt += 1
+    finaldf = pd.concat(dflist, axis=0)
     
     return finaldf
 
-def download(filename, savedir):
-    baseurl = 'https://www.ncei.noaa.gov/pub/data/noaa/isd-lite/'
-    idx = filename.rfind('-') + 1
-    year = filename[idx:(idx+4)]
-    url = baseurl + year + '/'
-    print('Downloading %s' %filename)
+def processISDLiteChunks(savedir, stations, variables, starttime, endtime, chunk_days=30, baseurl=ISD_LITE_URL,
+                         workers=8, retries=3, keep_gz=True, processes=1, compact=False, refresh_current=False,
+                         after=None, cache=False, metrics=None):
+    """
+    Processes ISD Lite observations like processISDLite, but a few days at a time so memory 
+    use doesn't grow with the length of the window. Every file is downloaded first, then the 
+    window is split into chunks of chunk_days days, starting at midnight, and a dataframe 
+    with every station is produced for each chunk in turn. 
+
+    Precip is organized using the observations on both sides of each chunk, so the output of
+    all of the chunks put together is the same as the output of processISDLite.
+
+    Parameters:
+        chunk_days (int) - Default: 30, the number of days in each chunk.
+        The other parameters are the same as for processISDLite.
+    Returns:
+        (generator) - (chunkstart, chunkend, chunkdf) for each chunk in time order. chunkstart and
+            chunkend are the first and last hour of the chunk, both datetimes. A chunk that no
+            station has a file for is still yielded, with an empty chunkdf, so every day of the
+            window is covered.
+    """
+
+    start = datetime.strptime(starttime, DATE_FMT)
+    end = datetime.strptime(endtime, DATE_FMT)
+
+    if metrics is None:
+        metrics = RunMetrics()
+
+    index = fetchISD(savedir, stations, start, end, baseurl, workers, retries, keep_gz, refresh_current, metrics)
+    cachedir = cacheDirectory(savedir, cache)
+
+    stationlist = list()
+    for station in stations:
+        if station in index:
+            filelist = stationFiles(savedir, ISDfilename(index, [station], start, end))
+            if len(filelist) > 0:
+                stationlist.append((station, filelist))
+
+    pool = None
+    if processes > 1 and len(stationlist) > 1:
+        pool = ProcessPoolExecutor(max_workers=min(processes, len(stationlist)))
+
     try:
-        urllib.request.urlretrieve(url + filename, savedir + filename)
-    except Exception as e:
-        print(e)
+        for chunkstart, chunkend in chunkWindows(start, end, chunk_days):
+            print('Processing %s to %s. Please wait.' % (chunkstart.strftime(DATE_FMT), chunkend.strftime(DATE_FMT)))
+
+            jobs = chunkJobs(stationlist, variables, chunkstart, chunkend, (start, end), stations if compact else None,
+                             after, cachedir)
+
+            if len(jobs) > 0:
+                chunkdf = pd.concat(runStations(jobs, metrics, pool), axis=0)
+            else:
+                print('No data files for %s to %s.' % (chunkstart.strftime(DATE_FMT), chunkend.strftime(DATE_FMT)))
+                chunkdf = emptyChunk(variables, stations if compact else None)
+            yield chunkstart, chunkend, chunkdf
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+def processStations(savedir, stations, ready, variables, start, end, chunk_days=None, processes=1, compact=False,
+                    after=None, cache=False, metrics=None):
+    """
+    Process stations as their files come in, for a pipeline that is still downloading. The 
+    first chunk of each station is processed as soon as the station comes in from ready. The 
+    other chunks are processed once every station is in, like processISDLiteChunks. The output
+    is the same as processISDLiteChunks, or processISDLite when chunk_days is None.
+
+    Parameters:
+        stations (list) - the stations in ICAO format, in the order of the output.
+        ready (iterable) - the stations whose files are downloaded, in any order. See fetchISD.
+        start (datetime) - the first time of interest.
+        end (datetime) - the last time of interest.
+        chunk_days (int) - Default: None, the number of days in each chunk. When None the whole
+            window is one chunk.
+        The other parameters are the same as for processISDLite.
+    Returns:
+        (generator) - (chunkstart, chunkend, chunkdf) for each chunk in time order, including the
+            chunks without data, see processISDLiteChunks.
+    """
+
+    if metrics is None:
+        metrics = RunMetrics()
+
+    index = loadStationIndex('./isd-history.txt')
+    cachedir = cacheDirectory(savedir, cache)
+    windows = chunkWindows(start, end, chunk_days)
+    categories = stations if compact else None
+
+    pool = None
+    if processes > 1:
+        pool = ProcessPoolExecutor(max_workers=processes)
+
+    # The first chunk of every station, or the future of it when there is a process pool.
+
+    filelists = dict()
+    first = dict()
+    try:
+        for station in ready:
+            if station in filelists or station not in index:
+                continue
+            filelist = stationFiles(savedir, ISDfilename(index, [station], start, end))
+            filelists[station] = filelist
+            for job in chunkJobs([(station, filelist)], variables, windows[0][0], windows[0][1], (start, end),
+                                 categories, after, cachedir):
+                if pool is not None:
+                    first[station] = pool.submit(measuredStation, *job)
+                else:
+                    first[station] = processStation(*job, metrics=metrics)
+
+        stationlist = [(station, filelists[station]) for station in stations if len(filelists.get(station, [])) > 0]
+
+        for i, (chunkstart, chunkend) in enumerate(windows):
+            if i == 0:
+                dflist = list()
+                for station, filelist in stationlist:
+                    if station not in first:
+                        continue
+                    if pool is not None:
+                        stationdf, stationMetrics = first[station].result()
+                        metrics.merge(stationMetrics)
+                        dflist.append(stationdf)
+                    else:
+                        dflist.append(first[station])
+            else:
+                print('Processing %s to %s. Please wait.' % (chunkstart.strftime(DATE_FMT), chunkend.strftime(DATE_FMT)))
+                dflist = runStations(chunkJobs(stationlist, variables, chunkstart, chunkend, (start, end), categories,
+                                               after, cachedir), metrics, pool)
+
+            if len(dflist) > 0:
+                chunkdf = pd.concat(dflist, axis=0)
+            else:
+                print('No data files for %s to %s.' % (chunkstart.strftime(DATE_FMT), chunkend.strftime(DATE_FMT)))
+                chunkdf = emptyChunk(variables, categories)
+            yield chunkstart, chunkend, chunkdf
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+def chunkWindows(start, end, chunk_days=None):
+    """
+    Split a window into chunks of chunk_days days. Chunks after the first start at midnight.
+
+    Returns:
+        (list) - (chunkstart, chunkend) for each chunk, the first and last hour of it. The whole 
+            window is one chunk when chunk_days is None.
+    """
+
+    if chunk_days is None:
+        return [(start, end)]
+
+    windows = list()
+    chunkstart = start
+    while chunkstart <= end:
+        nextstart = datetime(chunkstart.year, chunkstart.month, chunkstart.day) + timedelta(days=chunk_days)
+        windows.append((chunkstart, min(end, nextstart - timedelta(hours=1))))
+        chunkstart = nextstart
+    return windows
+
+def chunkJobs(stationlist, variables, chunkstart, chunkend, bounds, categories, after, cachedir):
+    """
+    The processStation jobs for one chunk, for the stations with a file in the chunk's years.
+
+    Parameters:
+        stationlist (list) - (station, filelist) for each station.
+        bounds (tuple) - the (start, end) of the whole request.
+        categories (list) - the ICAO categories for the compact schema, or None.
+        See processStation for the other parameters.
+    Returns:
+        jobs (list) - the arguments for processStation of each station.
+    """
+
+    jobs = list()
+    for station, filelist in stationlist:
+        if any(chunkstart.year <= fileYear(file) <= chunkend.year for file in filelist):
+            since = after.get(station) if after is not None else None
+            jobs.append((station, filelist, list(variables), chunkstart, chunkend, categories, since, cachedir, bounds))
+    return jobs
+
+def emptyChunk(variables, categories=None):
+    """
+    A dataframe with the columns and types processStation returns but no rows, for a chunk
+    that no station has a file for.
+
+    Parameters:
+        variables (list) - the variables you are interested in.
+        categories (list) - Default: None, the ICAO categories for the compact schema.
+    Returns:
+        chunkdf (Dataframe) - the empty chunk.
+    """
+
+    chunkdf = organizePrecip(decodeISD(b''))
+    chunkdf.insert(1, 'ICAO', pd.Series(dtype='object'))
+    chunkdf = ISDvariablesort(chunkdf, list(variables))
+
+    if categories is not None:
+        chunkdf = compactISD(chunkdf, categories)
+
+    return chunkdf
+
+def fetchISD(savedir, stations, start, end, baseurl, workers, retries, keep_gz, refresh_current, metrics, ready=None):
+    """
+    Download the files needed for the stations and dates into savedir, unpacking them if
+    asked to. See processISDLite for the parameters.
+
+    When ready is given it is called with each station as soon as every file for it is in,
+    while the other downloads carry on, so the station can be processed straight away. 
+    Stations with nothing to download are passed to it first.
+
+    Returns:
+        index (StationIndex) - the station index the filenames were looked up in.
+    """
+
+    isdListFile = './isd-history.txt'
+
+    index = loadStationIndex(isdListFile)
+
+    # Plan the files for the stations, start, and end dates, leaving out years outside each
+    # station's period of record and files the server recently said don't exist. Download 
+    # these files into a passed save directory (savedir), unpacking them if asked to. 
+
+    print('Downloading necessary data files.')
+
+    if not os.path.exists(savedir):
+        os.makedirs(savedir)
+
+    missing = loadMissing(savedir)
+    plan = planDownloads(index, stations, start, end, savedir, missing)
+    filenames = plan.files
+    needed = plan.fetch
+    print(describePlan(plan))
+    metrics.info['files_expected'] = len(plan.files)
+    metrics.info['files_outside_period'] = len(plan.outside)
+    metrics.info['files_known_missing'] = len(plan.missing)
+
+    # Files for the current year keep growing on the server. When asked to, check the ones
+    # we already have and fetch them again only if they changed. The week of slack covers 
+    # the last updates to the previous year's files early in January. 
+
+    refresh = list()
+    validators = loadValidators(savedir)
+    if refresh_current:
+        current = (datetime.utcnow() - timedelta(days=7)).year
+        refresh = [file for file in filenames if isDownloaded(file, savedir) and int(file[-7:-3]) >= current]
+
+    # Each file is settled as soon as its download is done: counted, unpacked if asked to, and
+    # when it is the last one a station is waiting for, the station is passed to ready. Unpacking
+    # happens while the download stage is being timed, so the time it takes is kept in unpacked
+    # and taken back out of the download stage, leaving it in the decompress stage only.
+
+    downloaded = {'files': 0, 'bytes': 0}
+    unpacked = {'seconds': 0.0}
+    owners = dict()
+    waiting = dict()
+    if ready is not None:
+        for station in dict.fromkeys(stations):
+            for file in ISDfilename(index, [station], start, end):
+                owners.setdefault(file, list()).append(station)
+        for file in needed + refresh:
+            for station in owners.get(file, []):
+                waiting[station] = waiting.get(station, 0) + 1
+        for station in dict.fromkeys(stations):
+            if waiting.get(station, 0) == 0:
+                ready(station)
+
+    def settle(result):
+        if result.ok and result.status == 200:
+            downloaded['files'] += 1
+            downloaded['bytes'] += os.path.getsize(savedir + result.filename)
+        if result.ok and result.status != 304 and not keep_gz:
+            t = time.perf_counter()
+            with metrics.stage('decompress') as counts:
+                unpack(result.filename, savedir)
+                counts['files'] = 1
+                counts['bytes'] = os.path.getsize(savedir + result.filename.replace('.gz', '.isd'))
+            unpacked['seconds'] += time.perf_counter() - t
+        for station in owners.get(result.filename, []):
+            waiting[station] -= 1
+            if waiting[station] == 0:
+                ready(station)
+
+    with metrics.stage('download') as counts:
+        results = downloadISD(needed + refresh, savedir, baseurl=baseurl, workers=workers, retries=retries,
+                              validators={file: validators[file] for file in refresh if file in validators},
+                              on_result=settle)
+        counts.update(downloaded)
+    metrics.add('download', seconds=-unpacked['seconds'], calls=0)
+
+    failed = list()
+    unchanged = 0
+    for result in results:
+        if result.ok and result.status == 304:
+            unchanged += 1
+        elif not result.ok:
+            failed.append(result)
+            print('Failed to download %s after %d attempt(s): %s' % (result.filename, result.attempts, result.error))
+
+    if len(results) > 0:
+        saveValidators(savedir, validators, results)
+        saveMissing(savedir, missing, results)
+
+    print('Complete! %d of %d files downloaded, %d unchanged, %d failed.' % (len(results) - len(failed) - unchanged,
+                                                                             len(results), unchanged, len(failed)))
+
+    return index
+
+def cacheDirectory(savedir, cache):
+    """
+    The parsed data cache directory for the cache parameter of processISDLite, created if
+    needed. None when caching is off.
+    """
+
+    if not cache:
+        return None
+    cachedir = cache if isinstance(cache, str) else savedir + 'cache/'
+    if not os.path.exists(cachedir):
+        os.makedirs(cachedir)
+    return cachedir
+
+def runStations(jobs, metrics, pool=None):
+    """
+    Run processStation for every job, in a process pool when one is given.
+
+    Returns:
+        dflist (list) - the station dataframes in the order of the jobs.
+    """
+
+    # Worker processes record their stages in their own RunMetrics, which are sent back with 
+    # the results and added to ours.
+
+    if pool is not None and len(jobs) > 1:
+        outputs = list(pool.map(measuredStation, *zip(*jobs)))
+        for stationdf, stationMetrics in outputs:
+            metrics.merge(stationMetrics)
+        return [stationdf for stationdf, stationMetrics in outputs]
+
+    return [processStation(*job, metrics=metrics) for job in jobs]
+
+def processStation(station, filelist, variables, start, end, categories=None, after=None, cachedir=None,
+                   bounds=None, metrics=None):
+    """
+    Parse and organize all of the year files for one station. This runs in a worker 
+    process when processISDLite is given more than one process. 
+
+    Parameters:
+        station (String) - the station in ICAO format.
+        filelist (list) - the station's ISD files in year order.
+        variables (list) - the variables you are interested in.
+        start (datetime) - the first time of interest.
+        end (datetime) - the last time of interest.
+        categories (list) - Default: None, every station in the request. When given the station
+            is converted to the compact schema with these as the ICAO categories.
+        after (datetime) - Default: None, only keep observations after this time.
+        cachedir (String) - Default: None, the parsed data cache. When given, files are read through
+            the cache and only the columns needed for the variables are loaded.
+        bounds (tuple) - Default: None, the (start, end) of the whole request when start and end are
+            one chunk of it. Observations around the chunk are read too, so precip is organized
+            the same way it would be for the whole request. See readAround.
+        metrics (RunMetrics) - Default: None, records the parse and precip stages.
+    Returns:
+        stationdf (Dataframe) - the station's observations between start and end.
+    """
+
+    if metrics is None:
+        metrics = RunMetrics()
+
+    with metrics.stage('parse') as counts:
+        if bounds is None:
+            stationdf = readStation(filelist, variables, start, end, cachedir)
+        else:
+            stationdf, filelist = readAround(filelist, variables, start, end, bounds, cachedir)
+        counts['rows'] = len(stationdf)
+        counts['files'] = len(filelist)
+        counts['bytes'] = sum(os.path.getsize(file) for file in filelist)
+
+    if 'Six Hour Precip Depth' in stationdf.columns:
+        with metrics.stage('precip') as counts:
+            stationdf = organizePrecip(stationdf)
+            counts['rows'] = len(stationdf)
+
+    if bounds is not None:
+        stationdf = stationdf.loc[(stationdf['Datetime'] >= start) & (stationdf['Datetime'] <= end)]
+        stationdf.reset_index(inplace=True, drop=True)
+
+    if after is not None:
+        stationdf = stationdf.loc[stationdf['Datetime'] > after]
+        stationdf.reset_index(inplace=True, drop=True)
+
+    stationdf.insert(1, 'ICAO', station)
+    stationdf = ISDvariablesort(stationdf, variables)
+
+    if categories is not None:
+        stationdf = compactISD(stationdf, categories)
+
+    return stationdf
+
+def readStation(filelist, variables, start, end, cachedir=None):
+    """
+    Read a station's observations between start and end from its year files.
+    """
+
+    if cachedir is None:
+        stationdf = pd.concat([parseISD(file, start, end) for file in filelist], axis=0)
+    else:
+        columns = parsedColumns(variables)
+        stationdf = pd.concat([cachedParseISD(file, cachedir, columns) for file in filelist], axis=0)
+
+    stationdf = stationdf.loc[(stationdf['Datetime'] >= start) & (stationdf['Datetime'] <= end)]
+    stationdf.reset_index(inplace=True, drop=True)
+    return stationdf
+
+def readAround(filelist, variables, start, end, bounds, cachedir=None):
+    """
+    Read a station's observations between start and end along with at least PRECIP_CONTEXT
+    observations on either side, without going outside of bounds. organizePrecip only looks
+    that many rows away from a report, so organizing these observations gives the same result
+    between start and end as organizing everything in bounds. Rows rather than hours are
+    counted, so the padding grows until it holds enough of them.
+
+    Parameters:
+        filelist (list) - the station's ISD files in year order.
+        variables (list) - the variables you are interested in.
+        start (datetime) - the first time of interest.
+        end (datetime) - the last time of interest.
+        bounds (tuple) - the (start, end) of the whole request.
+        cachedir (String) - Default: None, the parsed data cache.
+    Returns:
+        stationdf (Dataframe) - the observations, including the padding.
+        files (list) - the files that were read.
+    """
+
+    pad = timedelta(days=1)
+    while True:
+        lo = max(bounds[0], start - pad)
+        hi = min(bounds[1], end + pad)
+        files = [file for file in filelist if lo.year <= fileYear(file) <= hi.year]
+        stationdf = readStation(files, variables, lo, hi, cachedir)
+
+        before = int((stationdf['Datetime'] < start).sum())
+        behind = int((stationdf['Datetime'] > end).sum())
+        if (before >= PRECIP_CONTEXT or lo == bounds[0]) and (behind >= PRECIP_CONTEXT or hi == bounds[1]):
+            return stationdf, files
+        pad = pad * 4
+
+def fileYear(filename):
+    """
+    The year of an ISD file named USAF-WBAN-YEAR.gz or USAF-WBAN-YEAR.isd.
+    """
+
+    return int(os.path.basename(filename).split('-')[2][:4])
+
+def measuredStation(*job):
+    """
+    Run processStation with its own RunMetrics, for worker processes.
+
+    Returns:
+        (stationdf, metrics) - the station's observations and the stages recorded for them.
+    """
+
+    metrics = RunMetrics()
+    return processStation(*job, metrics=metrics), metrics
+
+def isDownloaded(filename, savedir):
+    """
+    Check whether an ISD Lite file is already in savedir, either still compressed (.gz)
+    or unpacked (.isd).
+    """
+
+    return os.path.exists(savedir + filename) or os.path.exists(savedir + filename.replace('.gz', '.isd'))
+
+def stationFiles(savedir, filenames):
+    """
+    Find the local copy of each of a station's year files in savedir. When a year exists 
+    both as .isd and .gz the unpacked .isd is used. Years that were not downloaded are skipped.
+
+    Parameters:
+        savedir (String) - the directory containing the ISD files.
+        filenames (list) - the station's filenames in format USAF-WBAN-YEAR.gz, in year order.
+    Returns:
+        filelist (list) - the paths of the station files that exist, in year order.
+    """
+
+    filelist = list()
+    for file in filenames:
+        isd = savedir + file.replace('.gz', '.isd')
+        if os.path.exists(isd):
+            filelist.append(isd)
+        elif os.path.exists(savedir + file):
+            filelist.append(savedir + file)
+    return filelist
 
 def extractGzip(inputf, outputf):
     try:
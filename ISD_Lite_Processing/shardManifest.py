@@ -0,0 +1,330 @@
+import os
+import json
+import time
+import errno
+import socket
+import threading
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+DATE_FMT = '%Y%m%d_%H'
+
+# The checkpoints a shard goes through, in order. A shard without a state file is pending.
+
+SHARD_STATES = ('pending', 'downloaded', 'processed', 'uploaded')
+
+Shard = namedtuple('Shard', ['id', 'stations', 'start', 'end'])
+Shard.__doc__ = """
+One piece of a backfill: a group of stations over one calendar month, or the part of it that
+is inside the requested window.
+
+    id (String) - the shard name, g<group>-<yyyymm>.
+    stations (list) - the stations in ICAO format.
+    start (String) - the first hour of the shard in format yyyymmdd_HH.
+    end (String) - the last hour of the shard in format yyyymmdd_HH.
+"""
+
+def planShards(stations, start, end, group_size=25):
+    """
+    Split a backfill into shards of group_size stations by calendar month.
+
+    Parameters:
+        stations (list) - the stations in ICAO format.
+        start (datetime) - the first time of the backfill.
+        end (datetime) - the last time of the backfill.
+        group_size (int) - Default: 25, the number of stations in each shard.
+    Returns:
+        shards (list) - the shards, month by month and group by group within each month.
+    """
+
+    groups = [stations[i:i + group_size] for i in range(0, len(stations), group_size)]
+
+    shards = list()
+    month = datetime(start.year, start.month, 1)
+    while month <= end:
+        nextmonth = datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+        first = max(start, month)
+        last = min(end, nextmonth - timedelta(hours=1))
+        for g, group in enumerate(groups):
+            shards.append(Shard('g%03d-%s' % (g, month.strftime('%Y%m')), group, first.strftime(DATE_FMT),
+                                last.strftime(DATE_FMT)))
+        month = nextmonth
+    return shards
+
+def workerName():
+    """
+    Identify this process across hosts sharing a directory, host:pid.
+    """
+
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+def writeJSON(path, data):
+    tmp = '%s.%s.tmp' % (path, workerName().replace(':', '-'))
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+class ShardLock:
+    """
+    A lock file, held by one worker on any of the hosts sharing the directory. The file holds
+    the name of the worker and is touched by refresh so other workers can tell it is alive.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def refresh(self):
+        os.utime(self.path, None)
+
+    def release(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+def acquireLock(path, timeout):
+    """
+    Try to take a lock file without waiting. A lock left behind by a worker that died on this
+    host, or one that nobody has refreshed for timeout seconds, is taken over.
+
+    Parameters:
+        path (String) - the lock file.
+        timeout (float) - seconds after which an untouched lock is considered abandoned.
+    Returns:
+        (ShardLock) - the lock, or None if another worker holds it.
+    """
+
+    for attempt in range(2):
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as e:
+            owner = abandonedOwner(path, timeout) if e.errno == errno.EEXIST and attempt == 0 else None
+            if owner is None:
+                return None
+
+            # Move the abandoned lock out of the way first, so only one worker can take it over.
+            # If it turns out to be a new lock taken since we looked, put it back.
+
+            stale = '%s.%s.stale' % (path, workerName().replace(':', '-'))
+            try:
+                os.rename(path, stale)
+                with open(stale, 'r') as f:
+                    moved = f.read().strip()
+                if moved != owner:
+                    os.rename(stale, path)
+                    return None
+                os.remove(stale)
+            except OSError:
+                return None
+            continue
+
+        with os.fdopen(fd, 'w') as f:
+            f.write(workerName())
+        return ShardLock(path)
+    return None
+
+def abandonedOwner(path, timeout):
+    """
+    The owner of a lock file if it was abandoned, None if it is still held.
+    """
+
+    try:
+        age = time.time() - os.path.getmtime(path)
+        with open(path, 'r') as f:
+            owner = f.read().strip()
+    except OSError:
+        return None
+
+    host, _, pid = owner.rpartition(':')
+    if host == socket.gethostname() and pid.isdigit():
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return owner
+        except OSError:
+            pass
+    return owner if age > timeout else None
+
+class LockHeartbeat:
+    """
+    Refreshes lock files from a background thread every interval seconds, so other workers
+    don't take them over while this one is busy for longer than the lock timeout, e.g. while
+    it waits for another lock or uploads. Use it as a context manager. Locks taken inside it
+    are added with add, and removed with discard before they are released.
+    """
+
+    def __init__(self, locks, interval):
+        self.locks = list(locks)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+    def add(self, lock):
+        with self.lock:
+            self.locks.append(lock)
+
+    def discard(self, lock):
+        with self.lock:
+            if lock in self.locks:
+                self.locks.remove(lock)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            with self.lock:
+                for lock in self.locks:
+                    try:
+                        lock.refresh()
+                    except OSError:
+                        pass
+
+def waitForLock(path, timeout, poll=1.0):
+    """
+    Take a lock file, waiting for as long as another worker holds it.
+    """
+
+    while True:
+        lock = acquireLock(path, timeout)
+        if lock is not None:
+            return lock
+        time.sleep(poll)
+
+class Manifest:
+    """
+    The on-disk record of a backfill, kept in a directory that every worker can reach.
+    manifest.json holds the parameters of the backfill and the list of shards, and is written
+    once. Each shard's checkpoint is kept in its own file, shards/<id>.json, written only by
+    the worker holding the shard's lock in locks/<id>.lock, so workers never write the same file.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, 'manifest.json')
+        for sub in ('shards', 'locks', 'work'):
+            os.makedirs(os.path.join(directory, sub), exist_ok=True)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def create(self, params, shards, info=None):
+        """
+        Write the manifest for a new backfill, or check that an existing one is for the same
+        backfill so it can be resumed.
+
+        Parameters:
+            params (dict) - the parameters that define the backfill.
+            shards (list) - the shards, see planShards.
+            info (dict) - Default: None, anything else to keep with the manifest.
+        Raises:
+            ValueError - if the manifest in the directory is for a different backfill.
+        """
+
+        data = {'params': params, 'shards': [shard._asdict() for shard in shards], 'info': info or dict(),
+                'created': datetime.now().isoformat(timespec='seconds')}
+
+        text = json.dumps(data, indent=1)
+        tmp = '%s.%s.tmp' % (self.path, workerName().replace(':', '-'))
+        with open(tmp, 'w') as f:
+            f.write(text)
+        try:
+
+            # Link rather than rename, so when several workers start at once only one manifest wins.
+
+            os.link(tmp, self.path)
+        except FileExistsError:
+            pass
+        except OSError:
+
+            # Some shared filesystems have no hard links. Creating the file exclusively picks one
+            # manifest the same way, but it can be read before it is written, see load.
+
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                pass
+            else:
+                with os.fdopen(fd, 'w') as f:
+                    f.write(text)
+        finally:
+            os.remove(tmp)
+
+        saved = self.load()
+        if saved['params'] != params:
+            raise ValueError('%s is for a different backfill: %s' % (self.path, saved['params']))
+        return saved
+
+    def load(self, retries=10, wait=0.5):
+
+        # A manifest created without a hard link can be read while another worker is still
+        # writing it, so one that isn't complete yet is read again.
+
+        for attempt in range(retries + 1):
+            try:
+                with open(self.path, 'r') as f:
+                    return json.load(f)
+            except ValueError:
+                if attempt == retries:
+                    raise
+                time.sleep(wait)
+
+    def shards(self):
+        return [Shard(**shard) for shard in self.load()['shards']]
+
+    def statePath(self, shard):
+        return os.path.join(self.directory, 'shards', shard.id + '.json')
+
+    def workdir(self, shard):
+        """
+        The directory for the files of a shard that are waiting to be uploaded.
+        """
+
+        return os.path.join(self.directory, 'work', shard.id) + '/'
+
+    def state(self, shard):
+        """
+        The last checkpoint of a shard: a dictionary with 'state', one of SHARD_STATES, and
+        whatever was recorded with it.
+        """
+
+        try:
+            with open(self.statePath(shard), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'state': 'pending'}
+
+    def checkpoint(self, shard, state, **info):
+        """
+        Record that a shard reached a state. Call only while holding the shard's lock.
+        """
+
+        data = dict(self.state(shard), **info)
+        data['state'] = state
+        data['updated'] = datetime.now().isoformat(timespec='seconds')
+        data['worker'] = workerName()
+        writeJSON(self.statePath(shard), data)
+
+    def lock(self, shard, timeout):
+        """
+        Try to take a shard's lock, see acquireLock.
+        """
+
+        return acquireLock(os.path.join(self.directory, 'locks', shard.id + '.lock'), timeout)
+
+    def summary(self):
+        """
+        The number of shards in each state.
+        """
+
+        counts = {state: 0 for state in SHARD_STATES}
+        for shard in self.shards():
+            counts[self.state(shard)['state']] += 1
+        return counts
@@ -0,0 +1,143 @@
+import os
+import pickle
+
+from collections import namedtuple
+
+StationRecord = namedtuple('StationRecord', ['USAF', 'WBAN', 'BEGIN', 'END', 'LAT', 'LON'])
+
+# Column positions of the fields we need in isd-history.txt. These match the widths
+# [7, 6, 30, 5, 3, 5, 8, 9, 8, 9, 9] used to read the file with read_fwf.
+
+COLUMNS = {'USAF': (0, 7), 'WBAN': (7, 13), 'CALL': (51, 56), 'LAT': (56, 64), 'LON': (64, 73),
+           'BEGIN': (81, 90), 'END': (90, 99)}
+
+INDEX_VERSION = 1
+
+_loaded = dict()
+
+class StationIndex:
+    """
+    ICAO lookup table built from isd-history.txt. Each ICAO maps to every USAF-WBAN
+    record that has used that callsign, kept in the order they appear in the file.
+
+    BEGIN and END are integers in format yyyymmdd. LAT and LON are floats, or None
+    when the station history does not list a location.
+    """
+
+    def __init__(self, records):
+        self.records = records
+        self.newest = None
+
+    def __contains__(self, callsign):
+        return callsign in self.records
+
+    def asof(self):
+        """
+        The newest END date in the station history, yyyymmdd. This is roughly when the history
+        was written, stations still reporting then have an END close to it.
+        """
+
+        if self.newest is None:
+            self.newest = max((record.END for candidates in self.records.values() for record in candidates), default=0)
+        return self.newest
+
+    def lookup(self, callsign, year=None):
+        """
+        Find the station record for an ICAO callsign.
+
+        Parameters:
+            callsign (String) - the station in ICAO format, e.g. "KRDU"
+            year (int) - Default: None, the year the record is needed for. When given, the
+                record whose period of record covers the year is returned. If none covers it,
+                the record closest in time is returned. When None the first record is returned.
+        Returns:
+            (StationRecord) - the matching record, or None if the callsign is unknown.
+        """
+
+        candidates = self.records.get(callsign)
+        if not candidates:
+            return None
+        if year is None or len(candidates) == 1:
+            return candidates[0]
+
+        for record in candidates:
+            if record.BEGIN // 10000 <= year <= record.END // 10000:
+                return record
+
+        def distance(record):
+            return max(record.BEGIN // 10000 - year, year - record.END // 10000)
+
+        return min(candidates, key=distance)
+
+def parseStationHistory(isdListFile):
+    """
+    Read isd-history.txt into a dictionary of ICAO callsign -> list of StationRecord.
+    Stations without a callsign are skipped.
+    """
+
+    def field(line, name):
+        a, b = COLUMNS[name]
+        return line[a:b].strip()
+
+    records = dict()
+    with open(isdListFile, 'r') as f:
+        for line in f:
+            callsign = field(line, 'CALL')
+            begin = field(line, 'BEGIN')
+            if callsign == '' or not begin.isdigit():
+                continue
+            lat = field(line, 'LAT')
+            lon = field(line, 'LON')
+            record = StationRecord(field(line, 'USAF'), field(line, 'WBAN'), int(begin), int(field(line, 'END')),
+                                   float(lat) if lat else None, float(lon) if lon else None)
+            records.setdefault(callsign, list()).append(record)
+
+    return records
+
+def loadStationIndex(isdListFile='./isd-history.txt', indexFile=None):
+    """
+    Load the station index for isd-history.txt. The parsed index is pickled next to the
+    history file and reused until isd-history.txt changes (size or modification time),
+    and it is kept in memory so repeated calls in one process don't touch the disk.
+
+    Parameters:
+        isdListFile (String) - Default: './isd-history.txt', the station history file.
+        indexFile (String) - Default: None, where to persist the index. Defaults to the
+            history file name with a .idx extension.
+    Returns:
+        (StationIndex) - the station index.
+    """
+
+    if indexFile is None:
+        indexFile = os.path.splitext(isdListFile)[0] + '.idx'
+
+    stat = os.stat(isdListFile)
+    signature = (INDEX_VERSION, stat.st_size, stat.st_mtime_ns)
+    key = os.path.abspath(isdListFile)
+
+    if key in _loaded and _loaded[key][0] == signature:
+        return _loaded[key][1]
+
+    records = None
+    if os.path.exists(indexFile):
+        try:
+            with open(indexFile, 'rb') as f:
+                saved = pickle.load(f)
+            if saved['signature'] == signature:
+                records = saved['records']
+        except Exception:
+            records = None
+
+    if records is None:
+        records = parseStationHistory(isdListFile)
+        try:
+            tmp = indexFile + '.tmp'
+            with open(tmp, 'wb') as f:
+                pickle.dump({'signature': signature, 'records': records}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, indexFile)
+        except OSError as e:
+            print('Could not save station index: %s' % e)
+
+    index = StationIndex(records)
+    _loaded[key] = (signature, index)
+    return index
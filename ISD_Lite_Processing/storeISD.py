@@ -0,0 +1,265 @@
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from .processISDLite import (DATE_FMT, BOUNDS_PAD, fetchISD, cacheDirectory, chunkJobs, runStations, stationFiles,
+                             fileYear)
+from .ISDfilename import ISDfilename
+from .cacheISD import sourceSignature
+from .compactISD import compactISD
+from .downloadISD import ISD_LITE_URL
+from .metrics import RunMetrics
+
+# The processed observation columns and the names of their columns in the store, in the order
+# processISDLite returns them.
+
+COLUMNS = {
+    'Air Temperature': 'air_temperature',
+    'Dew Point Temperature': 'dew_point_temperature',
+    'Sea Level Pressure': 'sea_level_pressure',
+    'Wind Direction': 'wind_direction',
+    'Wind Speed Rate': 'wind_speed_rate',
+    'Sky Condition Code': 'sky_condition_code',
+    'One Hour Precip Depth': 'one_hour_precip_depth',
+    'Three Hour Precip Depth': 'three_hour_precip_depth',
+    'Six Hour Precip Depth': 'six_hour_precip_depth',
+    'Twelve Hour Precip Depth': 'twelve_hour_precip_depth',
+    'Other Precip Depth': 'other_precip_depth',
+}
+
+PRECIP_COLUMNS = ['One Hour Precip Depth', 'Three Hour Precip Depth', 'Six Hour Precip Depth',
+                  'Twelve Hour Precip Depth', 'Other Precip Depth']
+
+# Every variable, as passed to processISDLite. The store always keeps all of them.
+
+ALL_VARIABLES = ['Air Temperature', 'Dew Point Temperature', 'Sea Level Pressure', 'Wind Direction',
+                 'Wind Speed Rate', 'Sky Condition Code', 'Precip']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS observations (
+    station TEXT NOT NULL,
+    time INTEGER NOT NULL,
+    %s,
+    PRIMARY KEY (station, time)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS sources (
+    station_year TEXT PRIMARY KEY,
+    station TEXT NOT NULL,
+    source TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    first INTEGER NOT NULL,
+    last INTEGER NOT NULL
+);
+""" % ',\n    '.join('%s REAL' % col for col in COLUMNS.values())
+
+def variableColumns(variables):
+    """
+    The columns processISDLite returns for a list of variables, in the same order. Precip
+    stands for the five precip columns.
+
+    Raises:
+        ValueError - if a variable is not one of ALL_VARIABLES.
+    """
+
+    columns = list()
+    for variable in variables:
+        if variable == 'Precip':
+            columns.extend(PRECIP_COLUMNS)
+        elif variable in COLUMNS:
+            columns.append(variable)
+        else:
+            raise ValueError('Unknown variable %s' % variable)
+    return columns
+
+# Times are stored as whole seconds since EPOCH, without a time zone like the ISD times themselves.
+
+EPOCH = datetime(1970, 1, 1)
+
+def toSeconds(when):
+    return int((when - EPOCH) // timedelta(seconds=1))
+
+def fromSeconds(seconds):
+    return EPOCH + timedelta(seconds=seconds)
+
+class ObservationStore:
+    """
+    A local store of processed ISD Lite observations in an SQLite database, indexed by station
+    and time. Fill it with update, which downloads and processes only the station-years that are
+    new or changed since the last update, then answer questions with query without parsing any
+    ISD files again.
+
+    Every variable is stored, organized over the whole window of the update, the same way
+    processISDLite organizes precip when it is given that window as bounds.
+
+    Example:
+        store = ObservationStore('/home/user/ISDdir/isd-store.db')
+        store.update('/home/user/ISDdir/', ['KRDU', 'KABE'], '20100101_00', '20220101_00')
+        df = store.query(['KRDU'], '20150301_00', '20150331_23', ['Air Temperature'])
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def query(self, stations, starttime, endtime, variables, compact=False):
+        """
+        Read observations from the store.
+
+        Parameters:
+            stations (list) - the stations in ICAO format.
+            starttime (String) - the first time in format yyyymmdd_HH.
+            endtime (String) - the last time in format yyyymmdd_HH.
+            variables (list) - the variables, as passed to processISDLite.
+            compact (Boolean) - Default: False, return the dataframe in the compact schema. See compactISD.
+        Returns:
+            (dataframe) - the same columns processISDLite returns, stations in the order given.
+                Stations with nothing stored in the window are left out.
+        """
+
+        columns = variableColumns(variables)
+        first = toSeconds(datetime.strptime(starttime, DATE_FMT))
+        last = toSeconds(datetime.strptime(endtime, DATE_FMT))
+
+        sql = ('SELECT %s FROM observations WHERE station = ? AND time BETWEEN ? AND ? ORDER BY time'
+               % ', '.join(['time'] + [COLUMNS[col] for col in columns]))
+
+        dflist = list()
+        for station in stations:
+            rows = self.conn.execute(sql, (station, first, last)).fetchall()
+            if len(rows) == 0:
+                continue
+            values = np.array(rows, dtype='float64').reshape(len(rows), len(columns) + 1)
+            stationdf = pd.DataFrame(values[:, 1:], columns=columns)
+            stationdf.insert(0, 'Datetime', pd.to_datetime(values[:, 0].astype('int64'), unit='s'))
+            stationdf.insert(1, 'ICAO', station)
+            dflist.append(stationdf)
+
+        if len(dflist) == 0:
+            df = pd.DataFrame({'Datetime': pd.Series(dtype='datetime64[ns]'), 'ICAO': pd.Series(dtype='object')})
+            for col in columns:
+                df[col] = pd.Series(dtype='float64')
+        else:
+            df = pd.concat(dflist, axis=0)
+
+        if compact:
+            df = compactISD(df, stations)
+        return df
+
+    def add(self, df):
+        """
+        Add processed observations to the store. Rows for a station and time already stored
+        replace the values of the columns df has.
+
+        Parameters:
+            df (dataframe) - observations as processISDLite returns them.
+        Returns:
+            (int) - the number of rows added.
+        """
+
+        columns = [col for col in COLUMNS if col in df.columns]
+        names = [COLUMNS[col] for col in columns]
+        sql = ('INSERT INTO observations (%s) VALUES (%s) ON CONFLICT (station, time) DO %s'
+               % (', '.join(['station', 'time'] + names), ', '.join('?' * (len(names) + 2)),
+                  'UPDATE SET ' + ', '.join('%s = excluded.%s' % (n, n) for n in names) if names else 'NOTHING'))
+
+        # SQLite stores NaN as NULL, so missing values come back as NaN.
+
+        values = [df[col].astype('float64').to_numpy().tolist() for col in columns]
+        times = df['Datetime'].to_numpy().astype('datetime64[s]').astype('int64')
+        rows = zip(df['ICAO'].astype(str).tolist(), times.tolist(), *values)
+        with self.conn:
+            self.conn.executemany(sql, rows)
+        return len(df)
+
+    def update(self, savedir, stations, starttime, endtime, baseurl=ISD_LITE_URL, workers=8, keep_gz=True,
+               processes=1, refresh_current=False, cache=False, metrics=None):
+        """
+        Download and store the observations for the stations and window. Station-years that are
+        already stored for the window from the same file are skipped, so after the first update
+        only new years, and files that changed on the server, are processed.
+
+        Parameters:
+            savedir (String) - the directory to save the downloaded ISD files.
+            stations (list) - the stations in ICAO format.
+            starttime (String) - the start time in format yyyymmdd_HH.
+            endtime (String) - the end time in format yyyymmdd_HH.
+            refresh_current (Boolean) - Default: False, download the current year's files again if
+                they changed on the server, so the newest observations are stored.
+            See processISDLite for the other parameters.
+        Returns:
+            (int) - the number of station-years processed.
+        """
+
+        start = datetime.strptime(starttime, DATE_FMT)
+        end = datetime.strptime(endtime, DATE_FMT)
+
+        if metrics is None:
+            metrics = RunMetrics()
+
+        index = fetchISD(savedir, stations, start, end, baseurl, workers, 3, keep_gz, refresh_current, metrics)
+        cachedir = cacheDirectory(savedir, cache)
+
+        # A station-year is processed again when its file changed or the window asks for hours
+        # of it that are not stored yet.
+
+        stored = {row[0]: row[1:] for row in self.conn.execute(
+            'SELECT station_year, source, size, mtime_ns, first, last FROM sources')}
+
+        changed = dict()
+        for station in stations:
+            if station not in index:
+                continue
+            filelist = stationFiles(savedir, ISDfilename(index, [station], start, end))
+            for file in filelist:
+                year = fileYear(file)
+                key = os.path.basename(file).split('.')[0]
+                signature = sourceSignature(file)
+                first = toSeconds(max(start, datetime(year, 1, 1)))
+                last = toSeconds(min(end, datetime(year, 12, 31, 23)))
+
+                previous = stored.get(key)
+                if previous is not None and previous[:3] == (signature['source'], signature['size'],
+                                                              signature['mtime_ns']):
+                    if previous[3] <= first and last <= previous[4]:
+                        continue
+                    first, last = min(first, previous[3]), max(last, previous[4])
+                changed.setdefault(year, list()).append((station, filelist, key, signature, first, last))
+
+        print('%d station-years to store.' % sum(len(entries) for entries in changed.values()))
+
+        # Each year is processed with a month of the years around it, so precip at the turn of
+        # the year is organized with the observations on both sides.
+
+        pool = ProcessPoolExecutor(max_workers=processes) if processes > 1 else None
+        try:
+            for year in sorted(changed):
+                entries = changed[year]
+                yearstart = max(start, fromSeconds(min(entry[4] for entry in entries)) - BOUNDS_PAD)
+                yearend = min(end, fromSeconds(max(entry[5] for entry in entries)) + BOUNDS_PAD)
+                jobs = chunkJobs([entry[:2] for entry in entries], ALL_VARIABLES, yearstart, yearend, (start, end),
+                                 None, None, cachedir)
+                dflist = runStations(jobs, metrics, pool)
+
+                with metrics.stage('store') as counts:
+                    counts['rows'] = self.add(pd.concat(dflist, axis=0)) if len(dflist) > 0 else 0
+                    with self.conn:
+                        self.conn.executemany('INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                              [(key, station, signature['source'], signature['size'],
+                                                signature['mtime_ns'], first, last)
+                                               for station, filelist, key, signature, first, last in entries])
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        return sum(len(entries) for entries in changed.values())
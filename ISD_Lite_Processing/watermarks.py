@@ -0,0 +1,93 @@
+import os
+import json
+
+from datetime import datetime, timedelta
+
+WATERMARK_FMT = '%Y-%m-%d %H:%M:%S'
+
+# Default name of the watermark file, kept in the save directory of the run.
+
+WATERMARK_FILE = 'isd-watermarks.json'
+
+def loadWatermarks(filename):
+    """
+    Load the per-station watermarks, the time of the last observation uploaded for each
+    station.
+
+    Parameters:
+        filename (String) - the watermark file. A missing file means nothing was uploaded yet.
+    Returns:
+        (dict) - ICAO -> datetime
+    """
+
+    if not os.path.exists(filename):
+        return dict()
+    with open(filename, 'r') as f:
+        return {station: datetime.strptime(tms, WATERMARK_FMT) for station, tms in json.load(f).items()}
+
+def saveWatermarks(filename, watermarks):
+    """
+    Save the per-station watermarks. The file is replaced in one step so an interrupted
+    run never leaves it half written.
+
+    Parameters:
+        filename (String) - the watermark file.
+        watermarks (dict) - ICAO -> datetime
+    """
+
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({station: tms.strftime(WATERMARK_FMT) for station, tms in watermarks.items()}, f,
+                  indent=1, sort_keys=True)
+    os.replace(tmp, filename)
+
+def incrementalStart(watermarks, stations, start, lookback=timedelta(days=1)):
+    """
+    Find where an incremental run has to start processing. That is the oldest watermark of
+    the requested stations, less a lookback so precip reports near the watermark are still
+    organized with the reports before them. A station without a watermark needs the
+    whole window.
+
+    Parameters:
+        watermarks (dict) - ICAO -> datetime
+        stations (list) - the stations in the run.
+        start (datetime) - the start of the requested window.
+        lookback (timedelta) - Default: 1 day, how much data before the watermark to process.
+    Returns:
+        (datetime) - the time to start processing at, never earlier than start.
+    """
+
+    if len(stations) == 0 or any(station not in watermarks for station in stations):
+        return start
+    oldest = min(watermarks[station] for station in stations) - lookback
+    return max(start, oldest.replace(minute=0, second=0, microsecond=0))
+
+def advanceWatermarks(watermarks, df, failedDays=(), until=None):
+    """
+    Move each station's watermark up to its newest uploaded observation. Observations on or
+    after the first day that failed to upload don't count, so they are retried by the next run.
+
+    Parameters:
+        watermarks (dict) - ICAO -> datetime. Updated in place.
+        df (Dataframe) - the observations that were uploaded, with 'ICAO' and 'Datetime' columns.
+        failedDays (list) - Default: (), the days that failed to upload as datetimes at midnight.
+        until (datetime) - Default: None, the end of the last day written. Observations in df
+            at or after it were not uploaded, e.g. those at a midnight end time, and don't count.
+    Returns:
+        watermarks (dict) - the updated watermarks.
+    """
+
+    if len(failedDays) > 0:
+        df = df.loc[df['Datetime'] < min(failedDays)]
+    if until is not None:
+        df = df.loc[df['Datetime'] < until]
+    if len(df) == 0:
+        return watermarks
+
+    newest = df.groupby(df['ICAO'].astype(str))['Datetime'].max()
+    for station, tms in newest.items():
+        tms = tms.to_pydatetime()
+        if station not in watermarks or tms > watermarks[station]:
+            watermarks[station] = tms
+
+    return watermarks
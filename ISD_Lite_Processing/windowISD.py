@@ -0,0 +1,89 @@
+import gzip
+import mmap
+
+# Every ISD Lite record starts with its time as 'YYYY MM DD HH'. The fields are zero padded
+# so comparing these 13 bytes compares the times, and records are in time order.
+
+KEY_WIDTH = 13
+
+def timeKey(tms):
+    """
+    The 13 byte record prefix for a time.
+    """
+
+    return b'%04d %02d %02d %02d' % (tms.year, tms.month, tms.day, tms.hour)
+
+def readISD(filename):
+    """
+    Get the contents of an ISD file without parsing them. Unpacked .isd files are memory
+    mapped, so only the pages that are looked at are read from disk. Compressed .gz files
+    are decompressed in memory.
+
+    Parameters:
+        filename (String) - the ISD file, .isd or .gz
+    Returns:
+        (bytes or mmap) - the contents of the file.
+    """
+
+    if filename.endswith('.gz'):
+        with gzip.open(filename, 'rb') as f:
+            return f.read()
+
+    with open(filename, 'rb') as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+
+            # Empty files can't be mapped.
+
+            return b''
+
+def lineStart(buf, pos):
+    """
+    The offset of the first record that starts at or after pos.
+    """
+
+    if pos <= 0:
+        return 0
+    idx = buf.find(b'\n', pos - 1)
+    return len(buf) if idx < 0 else idx + 1
+
+def firstRecord(buf, key):
+    """
+    Binary search for the offset of the first record whose time key is >= key. Returns
+    len(buf) if there is none.
+    """
+
+    lo, hi = 0, len(buf)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start = lineStart(buf, mid)
+        if start < len(buf) and buf[start:start+KEY_WIDTH] < key:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lineStart(buf, lo)
+
+def windowOffsets(buf, start=None, end=None):
+    """
+    Find the byte range of the records between start and end, both inclusive. Times are
+    compared to the hour, the resolution of ISD Lite records.
+
+    Parameters:
+        buf (bytes or mmap) - the contents of an ISD file, see readISD.
+        start (datetime) - Default: None, the first time of interest. None means the start of the file.
+        end (datetime) - Default: None, the last time of interest. None means the end of the file.
+    Returns:
+        (lo, hi) - the records in the window are buf[lo:hi]
+    """
+
+    lo = 0 if start is None else firstRecord(buf, timeKey(start))
+
+    # Appending 0xff makes the key sort after every record stamped with the same hour as end.
+
+    if end is None:
+        hi = len(buf)
+    else:
+        hi = firstRecord(buf, timeKey(end) + b'\xff')
+
+    return lo, max(lo, hi)
@@ -5,16 +5,55 @@
 # ==========================
 
 import os
+import re
+import queue
+import shutil
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
 
 from datetime import datetime, timedelta
-from ISD_Lite_Processing.processISDLite import processISDLite
+from ISD_Lite_Processing.processISDLite import processISDLite, processISDLiteChunks, processStations, fetchISD
+from ISD_Lite_Processing.downloadISD import ISD_LITE_URL
+from ISD_Lite_Processing.metrics import RunMetrics
+from ISD_Lite_Processing.pipeline import Pipeline
+from ISD_Lite_Processing.watermarks import WATERMARK_FILE, loadWatermarks, saveWatermarks, incrementalStart, advanceWatermarks
 from glob import glob
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from mysql import connector
 from __config import Configuration
 
 DATE_FMT = '%Y%m%d_%H'
 
-def ISD_Obs(starttime, endtime, savedir, stationList, variableList, backfill=True, overwrite_table=False):
+# The daily .csv files are named for their day, yyyymmdd.csv.
+
+DAY_FILE = re.compile(r'(\d{8})\.csv$')
+
+# Dataframe column -> Hindsight variable name, in the order rows are written for each observation.
+
+HINDSIGHT_VARIABLES = [
+    ('Air Temperature', 'temperature'),
+    ('Dew Point Temperature', 'dewpoint'),
+    ('Sea Level Pressure', 'seaLevelPress'),
+    ('Wind Direction', 'windDir'),
+    ('Wind Speed Rate', 'windSpeed'),
+    ('One Hour Precip Depth', 'precip1Hour'),
+    ('Three Hour Precip Depth', 'precip3Hour'),
+    ('Six Hour Precip Depth', 'precip6Hour'),
+]
+
+# The most items each queue of the pipeline holds: stations that are downloaded and waiting to
+# be processed, chunks waiting to be written and days waiting to be uploaded.
+
+QUEUE_DEPTHS = {'stations': 64, 'chunks': 2, 'days': 8}
+
+def ISD_Obs(starttime, endtime, savedir, stationList, variableList, backfill=True, overwrite_table=False,
+            baseurl=ISD_LITE_URL, download_workers=8, float_format=None,
+            day_workers=1, stream=False, processes=1, compact=False, incremental=False, watermark_file=None,
+            cache=False, report_file=None, prometheus_file=None, profile_dir=None, chunk_days=None,
+            upload_workers=1, diff_overwrite=False, batch_days=None, pipeline=False, queue_depths=None):
     """
     Fetches ISD Lite Data and uploads it to the Hindsight Database. 
 
@@ -26,10 +65,47 @@ def ISD_Obs(starttime, endtime, savedir, stationList, variableList, backfill=Tru
         variableList (String) - the name of the file containing the list of variables you're interested in. 
         backfill (Boolean) - Default: True, whether or not you want this function to operate in backfill mode.
         overwrite_table (Boolean) - Default: False, whether or not you want this function to overwrite data in existing table.
+        baseurl (String) - Default: the NCEI ISD Lite archive, the root URL to download ISD Lite files from.
+        download_workers (int) - Default: 8, the maximum number of simultaneous downloads.
+        float_format (String) - Default: None, a printf style format for the values in the .csv files, e.g. '%.2f'.
+            When None values are written the way str() writes them.
+        day_workers (int) - Default: 1, the number of threads used to write the daily .csv files.
+        stream (Boolean) - Default: False, upload each day straight from memory instead of writing
+            .csv files to savedir first.
+        processes (int) - Default: 1, the number of worker processes used to parse stations.
+        compact (Boolean) - Default: False, process the data in the compact schema to save memory.
+        incremental (Boolean) - Default: False, only upload observations newer than each station's watermark,
+            the last observation uploaded by an earlier incremental run. Current year files are only
+            downloaded again if they changed, and new rows are added to existing tables.
+        watermark_file (String) - Default: None, where incremental runs keep the watermarks. Defaults to
+            isd-watermarks.json in savedir.
+        cache (Boolean or String) - Default: False, keep parsed station-years in a cache so later runs don't
+            parse them again. See processISDLite.
+        report_file (String) - Default: None, write the time, rows, bytes and files of every stage of the run
+            to this JSON file.
+        prometheus_file (String) - Default: None, write the same numbers to this file in the Prometheus text
+            format, for the node_exporter textfile collector.
+        profile_dir (String) - Default: None, run every stage under cProfile and save the profiles to this
+            directory as <stage>.prof.
+        chunk_days (int) - Default: None, process, write and upload the window this many days at a time, 
+            so memory use stays the same however long the window is. When None the whole window is 
+            processed at once.
+        upload_workers (int) - Default: 1, the number of days uploaded at the same time, each on its own
+            connection and staging table. See uploadISD. Streamed uploads always run one day at a time.
+        diff_overwrite (Boolean) - Default: False, when adding to existing tables, only write the rows that 
+            are new or changed and count the rest as skipped. See uploadDay.
+        batch_days (int) - Default: None, upload the .csv files this many days at a time, with one load into
+            the staging table and one transaction for each block. See uploadBlock.
+        pipeline (Boolean) - Default: False, download, process, write and upload at the same time, passing 
+            stations, chunks and days from one stage to the next. See pipelineISD.
+        queue_depths (dict) - Default: None, the most items each queue of the pipeline holds, by queue name.
+            Queues not given keep their depth in QUEUE_DEPTHS.
     """
 
     print('Starting process.')
 
+    metrics = RunMetrics(profile_dir)
+
     # Create station and variable list from external files
 
     stations = list()
@@ -42,101 +118,435 @@ def ISD_Obs(starttime, endtime, savedir, stationList, variableList, backfill=Tru
         for line in f:
             variables.append(line.strip('\n'))
 
-    # Call processISDLite to generate our dataframe
+    # In incremental mode only process from just before the oldest watermark, and only keep
+    # observations past each station's watermark. 
+
+    watermarks = None
+    if incremental:
+        if watermark_file is None:
+            watermark_file = savedir + WATERMARK_FILE
+        watermarks = loadWatermarks(watermark_file)
+        starttime = incrementalStart(watermarks, stations, datetime.strptime(starttime, DATE_FMT)).strftime(DATE_FMT)
+        overwrite_table = True
+        print('Incremental run starting at %s.' % starttime)
+
+    # Convert our user's input dates into datetime to use for comparison in dataframe
+
+    start = datetime.strptime(starttime, DATE_FMT)
+    end = datetime.strptime(endtime, DATE_FMT)
+
+    # Call processISDLite to generate our dataframe. With chunk_days the window is processed 
+    # a chunk at a time instead, and each chunk is written and uploaded before the next one is
+    # read, on one database connection. In pipeline mode all of the stages run at once, see
+    # pipelineISD.
+
+    conn = None
+    chunks = list()
+    failed = list()
+    if pipeline:
+        failed = pipelineISD(savedir, stations, variables, start, end, backfill, overwrite_table, metrics,
+                             baseurl=baseurl, download_workers=download_workers, float_format=float_format,
+                             stream=stream, processes=processes, compact=compact, refresh_current=incremental,
+                             watermarks=watermarks, cache=cache, chunk_days=chunk_days, upload_workers=upload_workers,
+                             diff=diff_overwrite, batch_days=batch_days, queue_depths=queue_depths)
+        if incremental:
+            saveWatermarks(watermark_file, watermarks)
+    elif chunk_days is None:
+        df = processISDLite(savedir, stations, variables, starttime, endtime, baseurl=baseurl, workers=download_workers,
+                            processes=processes, compact=compact, refresh_current=incremental, after=watermarks,
+                            cache=cache, metrics=metrics)
+        chunks = [(start, end, df)]
+    else:
+        chunks = processISDLiteChunks(savedir, stations, variables, starttime, endtime, chunk_days=chunk_days,
+                                      baseurl=baseurl, workers=download_workers, processes=processes, compact=compact,
+                                      refresh_current=incremental, after=watermarks, cache=cache, metrics=metrics)
+        conn = connectHindsight()
+
+    try:
+        for chunkstart, chunkend, df in chunks:
+            convertISD(df, variables)
+
+            if stream:
+                print('Streaming daily data into the database.')
+                failed += streamISD(streamDays(df, chunkstart, chunkend, float_format, skip_empty=incremental,
+                                               metrics=metrics), backfill, overwrite_table, conn=conn, metrics=metrics,
+                                     diff=diff_overwrite)
+            else:
+                print('Starting daily separation and .csv generation process.')
+
+                filenames = writeDays(df, chunkstart, chunkend, savedir, float_format=float_format, workers=day_workers,
+                                      skip_empty=incremental, metrics=metrics)
+
+                print('Separation process complete!')
+
+                failed += uploadISD(savedir, backfill, overwrite_table, conn=conn, metrics=metrics,
+                                    filelist=filenames, workers=upload_workers,
+                                    diff=diff_overwrite, batch_days=batch_days)
+
+            # Days that failed in an earlier chunk keep the watermarks from moving past them.
+
+            if incremental:
+                advanceWatermarks(watermarks, df, [datetime.strptime(filedate, '%Y%m%d') for filedate in failed],
+                                  until=daysEnd(chunkend))
+                saveWatermarks(watermark_file, watermarks)
+    finally:
+        if conn is not None:
+            conn.close()
+
+    # Report how long each stage took.
+
+    metrics.info['failed_days'] = failed
+    print(metrics.summary())
+    if report_file is not None:
+        metrics.writeReport(report_file)
+    if prometheus_file is not None:
+        metrics.writePrometheus(prometheus_file)
+    metrics.writeProfiles()
+
+def pipelineISD(savedir, stations, variables, start, end, backfill, overwrite_table, metrics, baseurl=ISD_LITE_URL,
+                download_workers=8, float_format=None, stream=False, processes=1, compact=False, refresh_current=False,
+                watermarks=None, cache=False, chunk_days=None, upload_workers=1, diff=False, batch_days=None,
+                queue_depths=None):
+    """
+    Fetch, process, write and upload ISD Lite data with every stage running at the same time, 
+    connected by bounded queues:
+
+        download -> stations -> process -> chunks -> write -> days -> upload
+
+    Each station is processed as soon as its files are downloaded, and each day is uploaded 
+    as soon as it is written, while later ones are still being processed. A stage waits when 
+    the queue after it is full, so memory use is bounded by the queue depths. If a stage fails,
+    the others stop after what they are doing and the error is raised.
+
+    A day needs every station, so the first chunk is only written once every station is 
+    downloaded and processed. With chunk_days, later chunks are processed while earlier ones 
+    are written and uploaded.
+
+    Parameters:
+        stations (list) - the stations in ICAO format.
+        variables (list) - the variables you are interested in.
+        start (datetime) - the first time of interest.
+        end (datetime) - the last time of interest.
+        backfill (Boolean) - whether or not to use the backfill staging table.
+        overwrite_table (Boolean) - whether or not to overwrite or add data to existing tables.
+        metrics (RunMetrics) - records every stage.
+        watermarks (dict) - Default: None, ICAO -> datetime of an incremental run. Only newer observations 
+            are uploaded, and the watermarks are advanced in place once the pipeline is done.
+        refresh_current (Boolean) - Default: False, check current year files for updates.
+        diff (Boolean) - Default: False, only write new and changed rows to existing tables. See uploadDay.
+        queue_depths (dict) - Default: None, the depths of the queues by name, see QUEUE_DEPTHS.
+        See ISD_Obs for the other parameters. 
+    Returns:
+        failed (list) - the days, in format yyyymmdd, that failed to upload.
+    """
+
+    depths = dict(QUEUE_DEPTHS, **(queue_depths or dict()))
+
+    pipe = Pipeline()
+    ready = pipe.queue(depths['stations'])
+    chunks = pipe.queue(depths['chunks'])
+    days = pipe.queue(depths['days'])
+
+    def download():
+        fetchISD(savedir, stations, start, end, baseurl, download_workers, 3, True, refresh_current, metrics,
+                 ready=lambda station: pipe.put(ready, station))
+
+    def process():
+        for chunk in processStations(savedir, stations, pipe.items(ready), variables, start, end, chunk_days=chunk_days,
+                                     processes=processes, compact=compact, after=watermarks, cache=cache,
+                                     metrics=metrics):
+            pipe.put(chunks, chunk)
 
-    df = processISDLite(savedir, stations, variables, starttime, endtime)
+    # The newest observation of each station on each day, to advance the watermarks with.
 
-    # Convert celcius temperatures to kelvin and kts to m/s.
+    newest = list()
+
+    def write():
+        for chunkstart, chunkend, df in pipe.items(chunks):
+            convertISD(df, variables)
+            if watermarks is not None and len(df) > 0:
+                stationDays = df.groupby([df['ICAO'].astype(str), df['Datetime'].dt.normalize()])['Datetime'].max()
+                newest.append(stationDays.reset_index(level=0).reset_index(drop=True))
+
+            if stream:
+                for filedate, text in streamDays(df, chunkstart, chunkend, float_format, skip_empty=watermarks is not None,
+                                                 metrics=metrics):
+                    pipe.put(days, (filedate, text))
+            else:
+                for day, tempdf in dayFrames(df, chunkstart, chunkend, skip_empty=watermarks is not None):
+                    filename = writeDay(day, tempdf, savedir, float_format, metrics)
+                    print('Created ' + filename)
+                    pipe.put(days, filename)
+
+    failed = list()
+    workerNumbers = iter(range(upload_workers))
+
+    def upload():
+        conn = connectHindsight()
+        try:
+            staging_table = None
+            if upload_workers > 1:
+                staging_table = workerStaging(conn, backfill, next(workerNumbers))
+            tables = fetchTables(conn)
+
+            block = list()
+            for item in pipe.items(days):
+                if stream:
+                    filedate, text = item
+                    if uploadDay(conn, filedate, backfill, overwrite_table, text=text, metrics=metrics,
+                                 staging_table=staging_table, diff=diff, tables=tables) == 'failed':
+                        failed.append(filedate)
+                    continue
+
+                block.append(item)
+                if len(block) >= (batch_days or 1):
+                    failed.extend(uploadFiles(conn, block, backfill, overwrite_table, tables, metrics=metrics,
+                                              staging_table=staging_table, diff=diff, batch=batch_days is not None))
+                    block = list()
+
+            if len(block) > 0:
+                failed.extend(uploadFiles(conn, block, backfill, overwrite_table, tables, metrics=metrics,
+                                          staging_table=staging_table, diff=diff, batch=batch_days is not None))
+        finally:
+            conn.close()
+
+    pipe.stage('download', download, output=ready)
+    pipe.stage('process', process, output=chunks)
+    pipe.stage('write', write, output=days)
+    pipe.stage('upload', upload, workers=upload_workers)
+
+    print('Starting the pipeline.')
+    pipe.run()
+    print('Pipeline complete!')
+
+    if watermarks is not None and len(newest) > 0:
+        advanceWatermarks(watermarks, pd.concat(newest, axis=0), [datetime.strptime(filedate, '%Y%m%d')
+                                                                   for filedate in failed], until=daysEnd(end))
+
+    return sorted(failed)
+
+def convertISD(df, variables):
+    """
+    Convert celcius temperatures to kelvin and kts to m/s, in place.
+
+    Parameters:
+        df (Dataframe) - the observations from processISDLite.
+        variables (list) - the variables that were requested.
+    """
 
     if 'Air Temperature' in variables:
-        df['Air Temperature'] = df['Air Temperature'] + 273.15
+        df['Air Temperature'] = convertUnits(df['Air Temperature'], lambda x: x + 273.15)
     
     if 'Dew Point Temperature' in variables:
-        df['Dew Point Temperature'] = df['Dew Point Temperature'] + 273.15
+        df['Dew Point Temperature'] = convertUnits(df['Dew Point Temperature'], lambda x: x + 273.15)
 
     if 'Wind Speed Rate' in variables:
-        df['Wind Speed Rate'] = df['Wind Speed Rate'] * 0.514444
+        df['Wind Speed Rate'] = convertUnits(df['Wind Speed Rate'], lambda x: x * 0.514444)
 
-    # Convert our user's input dates into datetime to use for comparison in dataframe
+def convertUnits(values, convert):
+    """
+    Apply a unit conversion to a column. Compact schema (float32) columns are converted in 
+    float64 from their original tenths, and the result is kept in float64. Only the parsed
+    values are compact, the converted ones are the same as the default schema gives, so the
+    .csv files don't depend on compact.
 
-    start = datetime.strptime(starttime, DATE_FMT)
-    end = datetime.strptime(endtime, DATE_FMT)
+    Parameters:
+        values (Series) - the column to convert.
+        convert (function) - the conversion.
+    Returns:
+        (Series) - the converted column.
+    """
 
-    print('Starting daily separation and .csv generation process.')
+    if values.dtype == 'float32':
+        return convert(values.astype('float64').round(1))
+    return convert(values)
 
-    current = datetime.strptime(start.strftime('%Y%m%d'), '%Y%m%d')
+def formatValues(values, float_format=None):
+    """
+    Format a column of values as strings for the LOAD DATA files. 
 
-    while current < end:
+    Parameters:
+        values (Series) - the values to format.
+        float_format (String) - Default: None, a printf style format, e.g. '%.2f'. When None 
+            values are formatted the way str() formats them.
+    Returns:
+        (ndarray) - the formatted values.
+    """
+
+    # Nullable integer columns from the compact schema are written like the float columns
+    # they replace, e.g. 230.0 and nan rather than 230 and <NA>.
+
+    if pd.api.types.is_extension_array_dtype(values.dtype) and pd.api.types.is_integer_dtype(values.dtype):
+        values = values.astype('float64')
+
+    if float_format is None:
+        return values.astype(str).to_numpy(dtype=object)
+    return np.char.mod(float_format, values.to_numpy(dtype='float64')).astype(object)
+
+def dayFrames(df, start, end, skip_empty=False):
+    """
+    Split the dataframe into calendar days, from the day of start up to end, in a single 
+    pass. Rows keep their original order within each day. Days without observations get 
+    an empty dataframe.
+
+    Parameters:
+        df (Dataframe) - the observations to split.
+        start (datetime) - the first time of interest.
+        end (datetime) - the last time of interest. 
+        skip_empty (Boolean) - Default: False, leave out days without observations.
+    Returns:
+        (generator) - (day, tempdf) for every day in date order.
+    """
 
-        # create a stop point for each day
+    groups = df.groupby(df['Datetime'].dt.normalize(), sort=False).indices
 
-        stop = current + timedelta(days=1)
+    current = datetime.strptime(start.strftime('%Y%m%d'), '%Y%m%d')
+    while current < end:
+        positions = groups.get(pd.Timestamp(current), [])
+        if len(positions) > 0 or not skip_empty:
+            yield current, df.iloc[positions].reset_index(drop=True)
+        current = current + timedelta(days=1)
 
-        # do dataframe search for right date 
+def daysEnd(end):
+    """
+    The midnight after the last day dayFrames yields for a window ending at end. Observations
+    from then on are not written, which with a midnight end time includes those at end itself.
+    """
 
-        tempdf = df.loc[(df['Datetime'] >= current) & (df['Datetime'] < stop)]
+    midnight = datetime(end.year, end.month, end.day)
+    return midnight if midnight == end else midnight + timedelta(days=1)
 
-        tempdf.reset_index(inplace=True, drop=True)
+def writeDays(df, start, end, savedir, float_format=None, workers=1, skip_empty=False, metrics=None):
+    """
+    Write a .csv file for every day from the day of start up to end. See dayFrames.
 
-        # generate .csv for each day 
+    Parameters:
+        df (Dataframe) - the observations to write.
+        start (datetime) - the first time of interest.
+        end (datetime) - the last time of interest. 
+        savedir (String) - the directory to write the .csv files to.
+        float_format (String) - Default: None, a printf style format for the values.
+        workers (int) - Default: 1, the number of threads used to write the files.
+        skip_empty (Boolean) - Default: False, don't write files for days without observations.
+        metrics (RunMetrics) - Default: None, records the 'csv' stage.
+    Returns:
+        filenames (list) - the files that were written, in date order.
+    """
 
-        filename = savedir + datetime.strftime(current, '%Y%m%d') + '.csv'
-        yr = str(current.year)
+    if metrics is None:
+        metrics = RunMetrics()
 
-        checklist = tempdf.columns.values.tolist()
+    def write(item):
+        day, tempdf = item
+        return writeDay(day, tempdf, savedir, float_format, metrics)
 
-        with open(filename, 'a') as f:
-            for i in tempdf.index:
-                tms = datetime.strftime(tempdf['Datetime'][i], '%Y-%m-%d %H:%M:%S')
-                if 'Air Temperature' in checklist:
-                    f.write(tempdf['ICAO'][i] + ',' + 'temperature,' + yr + ',' + tms + ',0,' + str(tempdf['Air Temperature'][i]) + ', ,1hr_isd,0' + '\n')
-                if 'Dew Point Temperature' in checklist:
-                    f.write(tempdf['ICAO'][i] + ',' + 'dewpoint,' + yr + ',' + tms + ',0,' + str(tempdf['Dew Point Temperature'][i]) + ', ,1hr_isd,0' + '\n')
-                if 'Sea Level Pressure' in checklist:
-                    f.write(tempdf['ICAO'][i] + ',' + 'seaLevelPress,' + yr + ',' + tms + ',0,' + str(tempdf['Sea Level Pressure'][i]) + ', ,1hr_isd,0' + '\n')
-                if 'Wind Direction' in checklist:
-                    f.write(tempdf['ICAO'][i] + ',' + 'windDir,' + yr + ',' + tms + ',0,' + str(tempdf['Wind Direction'][i]) + ', ,1hr_isd,0' + '\n')
-                if 'Wind Speed Rate' in checklist:
-                    f.write(tempdf['ICAO'][i] + ',' + 'windSpeed,' + yr + ',' + tms + ',0,' + str(tempdf['Wind Speed Rate'][i]) + ', ,1hr_isd,0' + '\n')
-                if 'One Hour Precip Depth' in checklist:
-                    f.write(tempdf['ICAO'][i] + ',' + 'precip1Hour,' + yr + ',' + tms + ',0,' + str(tempdf['One Hour Precip Depth'][i]) + ', ,1hr_isd,0' + '\n')
-                if 'Three Hour Precip Depth' in checklist:
-                    f.write(tempdf['ICAO'][i] + ',' + 'precip3Hour,' + yr + ',' + tms + ',0,' + str(tempdf['Three Hour Precip Depth'][i]) + ', ,1hr_isd,0' + '\n')
-                if 'Six Hour Precip Depth' in checklist:
-                    f.write(tempdf['ICAO'][i] + ',' + 'precip6Hour,' + yr + ',' + tms + ',0,' + str(tempdf['Six Hour Precip Depth'][i]) + ', ,1hr_isd,0' + '\n')
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            filenames = list(pool.map(write, dayFrames(df, start, end, skip_empty)))
+    else:
+        filenames = [write(item) for item in dayFrames(df, start, end, skip_empty)]
 
+    for filename in filenames:
         print('Created ' + filename)
-        
-        # assign the next day to current. 
 
-        current = stop
-    
-    print('Separation process complete!')
+    return filenames
 
-    uploadISD(savedir, backfill, overwrite_table)
+def writeDay(day, tempdf, savedir, float_format, metrics):
+    """
+    Write the .csv file for one day, savedir/yyyymmdd.csv, recording it in the 'csv' stage.
 
-def uploadISD(savedir, is_backfilling, overwrite_table):
+    Returns:
+        filename (String) - the file that was written.
     """
-    Actually uploads processed ISD Lite Data into Hindsight Database. 
+
+    filename = savedir + datetime.strftime(day, '%Y%m%d') + '.csv'
+    with metrics.stage('csv') as counts:
+        counts['rows'] = writeDayCSV(tempdf, filename, str(day.year), float_format=float_format)
+        counts['bytes'] = os.path.getsize(filename)
+        counts['files'] = 1
+    return filename
+
+def streamDays(df, start, end, float_format=None, skip_empty=False, metrics=None):
+    """
+    Build the LOAD DATA text for every day from the day of start up to end in memory.
+    See dayFrames. The time spent building the text is recorded as the 'stream' stage
+    when metrics is given.
+
+    Returns:
+        (generator) - (date, text) for every day in date order, with date in format yyyymmdd.
+    """
+
+    if metrics is None:
+        metrics = RunMetrics()
+
+    for day, tempdf in dayFrames(df, start, end, skip_empty):
+        with metrics.stage('stream') as counts:
+            text = dayCSVText(tempdf, str(day.year), float_format)
+            counts['rows'] = text.count('\n')
+            counts['bytes'] = len(text)
+        yield datetime.strftime(day, '%Y%m%d'), text
+
+def writeDayCSV(tempdf, filename, yr, float_format=None):
+    """
+    Write one day of observations to a .csv file in the layout expected by the LOAD DATA 
+    statement in uploadISD. The whole file is built in memory and written to a temporary 
+    file that then replaces filename, so a rerun overwrites the day instead of duplicating it.
 
     Parameters:
-        savedir (String) - the directory containing the data to be uploaded.
-        is_backfilling (Boolean) - whether or not you want to use the backfill staging table in the database.
-        overwrite_table (Boolean) - whether or not you want to overwrite or add data to an existing table. 
+        tempdf (Dataframe) - the observations for the day.
+        filename (String) - the .csv file to write to.
+        yr (String) - the year written in the year column.
+        float_format (String) - Default: None, a printf style format for the values. When None 
+            values are written the way str() writes them.
+    Returns:
+        (int) - the number of lines written.
     """
 
-    config = Configuration()
-    RESET_STAGING_BACKFILL_ID = 'ResetAsosStagingBackfillId'
-    RESET_STAGING_ID = 'ResetAsosStagingId'
-    if is_backfilling:
-        staging_table = 'asos_staging_backfill'
-    else:
-        staging_table = 'asos_staging'
+    text = dayCSVText(tempdf, yr, float_format)
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, filename)
+    return text.count('\n')
 
-    filelist = glob(savedir + '**/*.csv', recursive=True)
-    filelist.sort()
+def dayCSVText(tempdf, yr, float_format=None):
+    """
+    Build the text of one day of observations in the layout expected by the LOAD DATA 
+    statement in uploadISD. Each observation gets one line per variable, in the order of 
+    HINDSIGHT_VARIABLES.
+
+    Parameters:
+        tempdf (Dataframe) - the observations for the day.
+        yr (String) - the year written in the year column.
+        float_format (String) - Default: None, a printf style format for the values. When None 
+            values are written the way str() writes them.
+    Returns:
+        (String) - the lines for the day.
+    """
+
+    columns = [(col, name) for col, name in HINDSIGHT_VARIABLES if col in tempdf.columns]
+    if len(tempdf) == 0 or len(columns) == 0:
+        return ''
+
+    # Build a (rows, variables) grid of every field that varies and flatten it row by row,
+    # so the lines come out in the same order as looping over rows and then variables. 
+
+    nvars = len(columns)
+    icao = np.repeat(tempdf['ICAO'].astype(str).to_numpy(dtype=object), nvars)
+    tms = np.repeat(tempdf['Datetime'].dt.strftime('%Y-%m-%d %H:%M:%S').to_numpy(dtype=object), nvars)
+    names = np.tile(np.array([',' + name + ',' + yr + ',' for col, name in columns], dtype=object), len(tempdf))
+    vals = np.column_stack([formatValues(tempdf[col], float_format) for col, name in columns]).ravel()
+
+    lines = icao + names + tms + ',0,' + vals + ', ,1hr_isd,0\n'
+    return ''.join(lines)
+
+def connectHindsight():
+    """
+    Open a connection to the hindsight_asos database using the settings in Configuration.
+    """
+
+    config = Configuration()
 
-    print('Starting Upload Process')
     print('Connecting to database')
 
     conn = connector.MySQLConnection(user=      config.db['user'],
@@ -147,106 +557,640 @@ def uploadISD(savedir, is_backfilling, overwrite_table):
     
     print('Connected!')
 
-    for file in filelist:
-        try:
-            cursor = conn.cursor()
+    return conn
 
-            # Check to see if table exists. 
+def uploadISD(savedir, is_backfilling, overwrite_table, conn=None, metrics=None, filelist=None, workers=1, diff=False,
+              batch_days=None):
+    """
+    Actually uploads processed ISD Lite Data into Hindsight Database. 
 
-            filedate = parseDateFromFilename(file)
-            myTableName = 'asos_' + filedate
-            tableExists = False
-
-            fetch_asos_table_names = (
-                "SHOW TABLES IN hindsight_asos;"
-            )
-
-            cursor.execute(fetch_asos_table_names)
-            response = cursor.fetchall()
-            for r in response:
-                if r[0] == myTableName:
-                    tableExists = True
-                    break
-            
-            # if we're not overwriting existing table data and the table exists, move on to the next table. 
+    Parameters:
+        savedir (String) - the directory containing the data to be uploaded.
+        is_backfilling (Boolean) - whether or not you want to use the backfill staging table in the database.
+        overwrite_table (Boolean) - whether or not you want to overwrite or add data to an existing table. 
+        conn (MySQLConnection) - Default: None, the connection to use. When None a connection is opened
+            with connectHindsight and closed when the upload is done.
+        metrics (RunMetrics) - Default: None, records the staging_load, insert and commit stages. See uploadDay.
+        filelist (list) - Default: None, the .csv files to upload. When None every .csv file in savedir is uploaded.
+        workers (int) - Default: 1, the number of days, or blocks of days, to upload at the same time. With 
+            more than one, conn is not used. Each worker opens its own connection and loads into its own 
+            staging table instead, see uploadParallel.
+        diff (Boolean) - Default: False, only write new and changed rows to existing tables. See uploadDay.
+        batch_days (int) - Default: None, load this many days at a time into the staging table and copy 
+            them to their tables in one transaction, see uploadBlock. When None each day is loaded on its own.
+    Returns:
+        failed (list) - the days, in format yyyymmdd, that failed to upload.
+    """
 
-            if not overwrite_table and tableExists:
-                cursor.close()
-                continue
+    if filelist is None:
+        filelist = glob(savedir + '**/*.csv', recursive=True)
+    filelist = sorted(filelist)
+
+    print('Starting Upload Process')
+
+    size = batch_days if batch_days is not None else 1
+    blocks = [filelist[i:i + size] for i in range(0, len(filelist), size)]
+
+    if workers > 1 and len(blocks) > 1:
+        failed = uploadParallel(blocks, is_backfilling, overwrite_table, min(workers, len(blocks)), metrics, diff,
+                                batch=batch_days is not None)
+        print('Data upload complete!')
+        return failed
+
+    ownConnection = conn is None
+    if ownConnection:
+        conn = connectHindsight()
+
+    # The day tables that exist are looked up once, and kept up to date as tables are created.
+
+    tables = fetchTables(conn)
+
+    failed = list()
+    for block in blocks:
+        failed += uploadFiles(conn, block, is_backfilling, overwrite_table, tables, metrics=metrics, diff=diff,
+                              batch=batch_days is not None)
             
-            conn.start_transaction()
-
-            print('Clearing staging table.')
-            clear_staging_table = (
-                "DELETE FROM hindsight_asos." + staging_table + " WHERE `id` > 0;"
-            )
-            cursor.execute(clear_staging_table)
-            cursor.callproc('hindsight_asos.%s' % RESET_STAGING_BACKFILL_ID if is_backfilling else RESET_STAGING_ID)
-            print('Clear complete!')
-
-            load_file_to_staging = (
-                "LOAD DATA LOCAL INFILE %s "
-                "REPLACE INTO TABLE hindsight_asos." + staging_table + " "
-                "FIELDS TERMINATED BY ',' "
-                "LINES TERMINATED BY '\n' "
-                "(asos_id, var_name, year, time, altitude, numeric_val, qualitative_val, source, report_type)"
-            )
-
-            print('Loading %s into staging table...' % file)
-            cursor.execute(load_file_to_staging, (file,))
-
-            if not tableExists:
-                print('Creating new table.')
-                cursor.callproc('hindsight_asos.CreateAsosArchiveTable', (myTableName,))
-
-            copy_file_to_daily = (
-                "INSERT INTO hindsight_asos." + myTableName + " "
-                "(asos_id, var_id, year, time, altitude, numeric_val, qualitative_val, source, report_type) "
-                    "SELECT "
-                    "staging.asos_id, "
-                    "av.id, "
-                    "staging.year, "
-                    "staging.time, "
-                    "staging.altitude, "
-                    "staging.numeric_val, "
-                    "staging.qualitative_val, "
-                    "staging.source, " 
-                    "staging.report_type "
-                "FROM hindsight_asos." + staging_table + " staging "
-                    "INNER JOIN hindsight_asos.asos_variables av ON staging.var_name = av.id "
-                "ON DUPLICATE KEY UPDATE "
-                    "numeric_val = VALUES(numeric_val), "
-                    "qualitative_val = VALUES(qualitative_val), "
-                    "source = VALUES(source), "
-                    "report_type = VALUES(report_type)"
-            )
+    print('Data upload complete!')
+    if ownConnection:
+        conn.close()
 
-            print('Copying data from staging to %s.' % myTableName)
-            cursor.execute(copy_file_to_daily)
+    return failed
+
+def uploadFiles(conn, filelist, is_backfilling, overwrite_table, tables, metrics=None, staging_table=None, diff=False,
+                batch=False):
+    """
+    Upload .csv files on one connection, one day at a time (see uploadDay) or all together as 
+    one block (see uploadBlock). The files that are loaded are removed.
+
+    Parameters:
+        conn (MySQLConnection) - the database connection.
+        filelist (list) - the .csv files to upload.
+        tables (set) - the tables in the database, see fetchTables. Updated as tables are created.
+        batch (Boolean) - Default: False, upload the files as one block.
+        See uploadDay for the other parameters.
+    Returns:
+        failed (list) - the days, in format yyyymmdd, that failed to upload.
+    """
+
+    if batch:
+        status = uploadBlock(conn, filelist, is_backfilling, overwrite_table, tables, metrics=metrics,
+                             staging_table=staging_table, diff=diff)
+    else:
+        status = dict()
+        for file in filelist:
+            filedate = parseDateFromFilename(file)
+            status[filedate] = uploadDay(conn, filedate, is_backfilling, overwrite_table, filename=file, metrics=metrics,
+                                         staging_table=staging_table, diff=diff, tables=tables)
+
+    failed = list()
+    for file in filelist:
+        filedate = parseDateFromFilename(file)
+        if status[filedate] == 'loaded':
 
             # clean up
             os.remove(file)
+        elif status[filedate] == 'failed':
+            failed.append(filedate)
+    return failed
 
-            # Finish the transaction
-            conn.commit()
-            cursor.close()
-            print('Complete!')
+def uploadParallel(blocks, is_backfilling, overwrite_table, workers, metrics=None, diff=False, batch=False):
+    """
+    Upload .csv files on several connections at once. Each worker opens its own connection,
+    creates its own staging table on it (see workerStaging) and takes the next block of files 
+    from a shared queue until none are left, so loads into different day tables overlap. Every 
+    file is a different day, so no two workers write to the same table.
+
+    Parameters:
+        blocks (list) - lists of .csv files to upload. Each list is a single file unless batch is True.
+        is_backfilling (Boolean) - whether the staging tables are copies of the backfill staging table.
+        overwrite_table (Boolean) - whether or not you want to overwrite or add data to an existing table. 
+        workers (int) - the number of workers.
+        metrics (RunMetrics) - Default: None, records the staging_load, insert and commit stages. See uploadDay.
+        diff (Boolean) - Default: False, only write new and changed rows to existing tables. See uploadDay.
+        batch (Boolean) - Default: False, upload each list of files as one block, see uploadBlock.
+    Returns:
+        failed (list) - the days, in format yyyymmdd, that failed to upload, in date order.
+    """
+
+    work_queue = queue.Queue()
+    for block in blocks:
+        work_queue.put(block)
+
+    def work(worker):
+        conn = connectHindsight()
+        failed = list()
+        try:
+            staging_table = workerStaging(conn, is_backfilling, worker)
+            tables = fetchTables(conn)
+            while True:
+                try:
+                    block = work_queue.get_nowait()
+                except queue.Empty:
+                    break
+                failed += uploadFiles(conn, block, is_backfilling, overwrite_table, tables, metrics=metrics,
+                                      staging_table=staging_table, diff=diff, batch=batch)
+        finally:
+            conn.close()
+        return failed
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(work, range(workers)))
+
+    return sorted(filedate for failed in results for filedate in failed)
+
+def workerStaging(conn, is_backfilling, worker):
+    """
+    Create the staging table of one upload worker, a copy of the shared staging table. It is
+    a temporary table, so it is only seen by the worker's own connection and is dropped when
+    the connection closes. The database user needs the CREATE TEMPORARY TABLES privilege.
+
+    Parameters:
+        conn (MySQLConnection) - the worker's connection.
+        is_backfilling (Boolean) - whether to copy the backfill staging table.
+        worker (int) - the number of the worker.
+    Returns:
+        (String) - the name of the staging table.
+    """
+
+    shared = 'asos_staging_backfill' if is_backfilling else 'asos_staging'
+    staging_table = '%s_w%d' % (shared, worker)
+
+    cursor = conn.cursor()
+    cursor.execute("CREATE TEMPORARY TABLE IF NOT EXISTS hindsight_asos." + staging_table + " "
+                   "LIKE hindsight_asos." + shared + ";")
+    cursor.close()
+    return staging_table
+
+def fetchTables(conn):
+    """
+    Look up the tables in hindsight_asos.
+
+    Returns:
+        (set) - the table names.
+    """
+
+    cursor = conn.cursor()
+    cursor.execute("SHOW TABLES IN hindsight_asos;")
+    tables = set(r[0] for r in cursor.fetchall())
+    cursor.close()
+    return tables
+
+def streamISD(days, is_backfilling, overwrite_table, conn=None, metrics=None, diff=False):
+    """
+    Uploads days of processed ISD Lite Data into Hindsight Database straight from memory, 
+    without writing .csv files. Each day is fed to the same LOAD DATA statement uploadISD 
+    uses, so the data is loaded exactly as it would be from the files. 
+
+    Parameters:
+        days (iterable) - (date, text) for each day, with date in format yyyymmdd and text in
+            the layout built by dayCSVText. See streamDays.
+        is_backfilling (Boolean) - whether or not you want to use the backfill staging table in the database.
+        overwrite_table (Boolean) - whether or not you want to overwrite or add data to an existing table. 
+        conn (MySQLConnection) - Default: None, the connection to use. When None a connection is opened
+            with connectHindsight and closed when the upload is done.
+        metrics (RunMetrics) - Default: None, records the staging_load, insert and commit stages. See uploadDay.
+        diff (Boolean) - Default: False, only write new and changed rows to existing tables. See uploadDay.
+    Returns:
+        failed (list) - the days, in format yyyymmdd, that failed to upload.
+    """
+
+    print('Starting Upload Process')
+
+    ownConnection = conn is None
+    if ownConnection:
+        conn = connectHindsight()
+
+    tables = fetchTables(conn)
+
+    failed = list()
+    for filedate, text in days:
+        if uploadDay(conn, filedate, is_backfilling, overwrite_table, text=text, metrics=metrics, diff=diff,
+                     tables=tables) == 'failed':
+            failed.append(filedate)
 
-        except connector.Error as e:
-            print('There was an ERROR during the feed, rolling back: {}'.format(e))
-            conn.rollback()
-            
     print('Data upload complete!')
-    conn.close()
+    if ownConnection:
+        conn.close()
+
+    return failed
+
+def uploadDay(conn, filedate, is_backfilling, overwrite_table, filename=None, text=None, metrics=None,
+              staging_table=None, diff=False, tables=None):
+    """
+    Load one day of data into the staging table and copy it into the day's table, creating 
+    the table if it doesn't exist yet. Everything happens in one transaction, which is rolled 
+    back on a database error or an error feeding the data from memory.
+
+    Parameters:
+        conn (MySQLConnection) - the database connection.
+        filedate (String) - the day in format yyyymmdd.
+        is_backfilling (Boolean) - whether or not you want to use the backfill staging table in the database.
+        overwrite_table (Boolean) - whether or not you want to overwrite or add data to an existing table. 
+        filename (String) - Default: None, the .csv file to load. 
+        text (String) - Default: None, the day's data to load from memory when there is no file.
+        metrics (RunMetrics) - Default: None, records the time spent clearing and loading the staging 
+            table (staging_load), creating the table and copying the day into it (insert) and committing 
+            (commit), with the rows the database reports for each.
+        staging_table (String) - Default: None, load into this staging table instead of the shared one, 
+            see workerStaging. 
+        diff (Boolean) - Default: False, when adding to an existing table, compare the staging table with 
+            it and only copy the rows that are new or whose values changed, instead of every row. The 
+            rows are counted in the diff_inserted, diff_updated and diff_skipped stages.
+        tables (set) - Default: None, the tables in the database, see fetchTables. A table created for 
+            the day is added to it. When None the tables are looked up for this day.
+    Returns:
+        (String) - 'loaded', 'skipped' if the table exists and is not being overwritten, or 'failed'.
+    """
+
+    if metrics is None:
+        metrics = RunMetrics()
+
+    shared = staging_table is None
+    if shared:
+        staging_table = sharedStaging(is_backfilling)
+
+    try:
+        cursor = conn.cursor()
+
+        # Check to see if table exists. 
+
+        myTableName = 'asos_' + filedate
+        if tables is None:
+            tables = fetchTables(conn)
+        tableExists = myTableName in tables
+        
+        # if we're not overwriting existing table data and the table exists, move on to the next table. 
+
+        if not overwrite_table and tableExists:
+            cursor.close()
+            return 'skipped'
+
+        conn.start_transaction()
+
+        with metrics.stage('staging_load') as counts:
+            clearStaging(cursor, staging_table, shared, is_backfilling)
+
+            if filename is not None:
+                print('Loading %s into staging table...' % filename)
+                cursor.execute(loadStagingSQL(staging_table), (filename,))
+                counts['bytes'] = os.path.getsize(filename)
+            else:
+                print('Loading %s into staging table from memory...' % filedate)
+                with memoryInfile(text) as path:
+                    cursor.execute(loadStagingSQL(staging_table), (path,))
+                counts['bytes'] = len(text)
+            counts['rows'] = max(cursor.rowcount, 0)
+            counts['files'] = 1
+            loaded = counts['rows']
+
+        copyDay(cursor, filedate, staging_table, loaded, metrics, create=not tableExists, diff=diff and tableExists)
+
+        # Finish the transaction
+        with metrics.stage('commit'):
+            conn.commit()
+        cursor.close()
+        tables.add(myTableName)
+        print('Complete!')
+        return 'loaded'
+
+    except (connector.Error, OSError) as e:
+        print('There was an ERROR during the feed, rolling back: {}'.format(e))
+        conn.rollback()
+        return 'failed'
+
+def uploadBlock(conn, filelist, is_backfilling, overwrite_table, tables, metrics=None, staging_table=None, diff=False):
+    """
+    Upload a block of days at once. The missing day tables are created together first, then 
+    every file is loaded into the staging table with one LOAD DATA and each day is copied 
+    from it into its table, in one transaction. 
+
+    Creating a table commits on its own in MySQL, so it can't be rolled back with the rest of
+    the block. If the block fails, the tables it created are dropped again, so they aren't 
+    mistaken for days that were already uploaded.
+
+    Parameters:
+        conn (MySQLConnection) - the database connection.
+        filelist (list) - the .csv files of the block, one per day.
+        tables (set) - the tables in the database, see fetchTables. Updated as tables are created and dropped.
+        See uploadDay for the other parameters.
+    Returns:
+        (dict) - yyyymmdd -> 'loaded', 'skipped' or 'failed' for every file.
+    """
+
+    if metrics is None:
+        metrics = RunMetrics()
+
+    shared = staging_table is None
+    if shared:
+        staging_table = sharedStaging(is_backfilling)
+
+    status = dict()
+    days = list()
+    for file in filelist:
+        filedate = parseDateFromFilename(file)
+        if not overwrite_table and 'asos_' + filedate in tables:
+            status[filedate] = 'skipped'
+        else:
+            days.append((filedate, file))
+    if len(days) == 0:
+        return status
+
+    created = list()
+    cursor = conn.cursor()
+    try:
+        with metrics.stage('insert'):
+            for filedate, file in days:
+                if 'asos_' + filedate not in tables:
+                    print('Creating new table asos_%s.' % filedate)
+                    cursor.callproc('hindsight_asos.CreateAsosArchiveTable', ('asos_' + filedate,))
+                    tables.add('asos_' + filedate)
+                    created.append(filedate)
+
+        conn.start_transaction()
+
+        # The files are fed to LOAD DATA one after the other, counting the lines of each day on the way.
+
+        lines = dict()
+
+        def chunks():
+            for filedate, file in days:
+                with open(file, 'rb') as f:
+                    data = f.read()
+                lines[filedate] = data.count(b'\n')
+                yield data
+
+        with metrics.stage('staging_load') as counts:
+            clearStaging(cursor, staging_table, shared, is_backfilling)
+            print('Loading %s to %s into staging table...' % (days[0][0], days[-1][0]))
+            with pipeInfile(chunks()) as path:
+                cursor.execute(loadStagingSQL(staging_table), (path,))
+            counts['rows'] = max(cursor.rowcount, 0)
+            counts['bytes'] = sum(os.path.getsize(file) for filedate, file in days)
+            counts['files'] = len(days)
+
+        for filedate, file in days:
+            copyDay(cursor, filedate, staging_table, lines[filedate], metrics, diff=diff and filedate not in created,
+                    day=True)
+
+        # Finish the transaction
+        with metrics.stage('commit'):
+            conn.commit()
+        cursor.close()
+        print('Complete!')
+        status.update((filedate, 'loaded') for filedate, file in days)
+
+    except (connector.Error, OSError) as e:
+        print('There was an ERROR during the feed, rolling back: {}'.format(e))
+        conn.rollback()
+        for filedate in created:
+            try:
+                cursor.execute("DROP TABLE IF EXISTS hindsight_asos.asos_" + filedate + ";")
+                tables.discard('asos_' + filedate)
+            except connector.Error:
+                pass
+        status.update((filedate, 'failed') for filedate, file in days)
+
+    return status
+
+def sharedStaging(is_backfilling):
+    """
+    The name of the staging table shared by every upload.
+    """
+
+    if is_backfilling:
+        return 'asos_staging_backfill'
+    return 'asos_staging'
+
+def clearStaging(cursor, staging_table, shared, is_backfilling):
+    """
+    Delete every row from the staging table, and reset its ids if it is a shared one.
+    """
+
+    RESET_STAGING_BACKFILL_ID = 'ResetAsosStagingBackfillId'
+    RESET_STAGING_ID = 'ResetAsosStagingId'
+
+    print('Clearing staging table.')
+    clear_staging_table = (
+        "DELETE FROM hindsight_asos." + staging_table + " WHERE `id` > 0;"
+    )
+    cursor.execute(clear_staging_table)
+
+    # Only the shared staging tables have their ids reset, a worker's own table lasts 
+    # only as long as its connection.
+
+    if shared:
+        cursor.callproc('hindsight_asos.%s' % RESET_STAGING_BACKFILL_ID if is_backfilling else RESET_STAGING_ID)
+    print('Clear complete!')
+
+def loadStagingSQL(staging_table):
+    """
+    The LOAD DATA statement for the staging table. It takes the path of the file to load.
+    """
+
+    load_file_to_staging = (
+        "LOAD DATA LOCAL INFILE %s "
+        "REPLACE INTO TABLE hindsight_asos." + staging_table + " "
+        "FIELDS TERMINATED BY ',' "
+        "LINES TERMINATED BY '\n' "
+        "(asos_id, var_name, year, time, altitude, numeric_val, qualitative_val, source, report_type)"
+    )
+    return load_file_to_staging
+
+def copyDay(cursor, filedate, staging_table, loaded, metrics, create=False, diff=False, day=False):
+    """
+    Copy a day from the staging table into its table. Call within the upload's transaction.
+
+    Parameters:
+        cursor (MySQLCursor) - a cursor on the upload's connection.
+        filedate (String) - the day in format yyyymmdd.
+        staging_table (String) - the staging table the day was loaded into.
+        loaded (int) - the number of rows of the day in the staging table.
+        metrics (RunMetrics) - records the diff and insert stages.
+        create (Boolean) - Default: False, create the day's table first.
+        diff (Boolean) - Default: False, only copy new and changed rows, see uploadDay.
+        day (Boolean) - Default: False, only copy the staging rows of this day, for a staging table 
+            that holds several days.
+    """
+
+    myTableName = 'asos_' + filedate
+
+    # The rows of the day, when the staging table holds a block of days.
+
+    in_day = ''
+    if day:
+        nextday = (datetime.strptime(filedate, '%Y%m%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        in_day = ("staging.time >= '" + datetime.strptime(filedate, '%Y%m%d').strftime('%Y-%m-%d') + "' "
+                  "AND staging.time < '" + nextday + "' ")
+
+    copy_to_daily = (
+        "INSERT INTO hindsight_asos." + myTableName + " "
+        "(asos_id, var_id, year, time, altitude, numeric_val, qualitative_val, source, report_type) "
+            "SELECT "
+            "staging.asos_id, "
+            "av.id, "
+            "staging.year, "
+            "staging.time, "
+            "staging.altitude, "
+            "staging.numeric_val, "
+            "staging.qualitative_val, "
+            "staging.source, " 
+            "staging.report_type "
+        "FROM hindsight_asos." + staging_table + " staging "
+            "INNER JOIN hindsight_asos.asos_variables av ON staging.var_name = av.id "
+    )
+
+    update_duplicates = (
+        "ON DUPLICATE KEY UPDATE "
+            "numeric_val = VALUES(numeric_val), "
+            "qualitative_val = VALUES(qualitative_val), "
+            "source = VALUES(source), "
+            "report_type = VALUES(report_type)"
+    )
+
+    copy_file_to_daily = copy_to_daily + ("WHERE " + in_day if day else "") + update_duplicates
+
+    # For a diff, a staging row is unchanged if the day's table has a row with the same key 
+    # and the same values. Only the other rows are copied, so unchanged rows are never written. 
+
+    same_key = (
+        "daily.asos_id = staging.asos_id "
+        "AND daily.var_id = av.id "
+        "AND daily.year = staging.year "
+        "AND daily.time = staging.time "
+        "AND daily.altitude <=> staging.altitude "
+    )
+
+    unchanged_row = (
+        "SELECT 1 FROM hindsight_asos." + myTableName + " daily "
+        "WHERE " + same_key +
+            "AND daily.numeric_val <=> staging.numeric_val "
+            "AND daily.qualitative_val <=> staging.qualitative_val "
+            "AND daily.source <=> staging.source "
+            "AND daily.report_type <=> staging.report_type"
+    )
+
+    changed_rows = "WHERE " + (in_day + "AND " if day else "") + "NOT EXISTS (" + unchanged_row + ") "
+
+    count_changes = (
+        "SELECT COUNT(*), COUNT(daily.asos_id) "
+        "FROM hindsight_asos." + staging_table + " staging "
+            "INNER JOIN hindsight_asos.asos_variables av ON staging.var_name = av.id "
+            "LEFT JOIN hindsight_asos." + myTableName + " daily ON " + same_key +
+        changed_rows
+    )
+
+    copy_changes_to_daily = copy_to_daily + changed_rows + update_duplicates
+
+    if diff:
+        with metrics.stage('diff') as counts:
+            cursor.execute(count_changes)
+            changed, updated = cursor.fetchall()[0]
+            counts['rows'] = loaded
+        metrics.add('diff_inserted', rows=changed - updated)
+        metrics.add('diff_updated', rows=updated)
+        metrics.add('diff_skipped', rows=max(loaded - changed, 0))
+        print('%s: %d new rows, %d changed rows, %d unchanged rows skipped.' % (myTableName, changed - updated,
+                                                                                updated, max(loaded - changed, 0)))
+
+    with metrics.stage('insert') as counts:
+        if create:
+            print('Creating new table.')
+            cursor.callproc('hindsight_asos.CreateAsosArchiveTable', (myTableName,))
+
+        if not diff:
+            print('Copying data from staging to %s.' % myTableName)
+            cursor.execute(copy_file_to_daily)
+            counts['rows'] = max(cursor.rowcount, 0)
+        elif changed > 0:
+            print('Copying changes from staging to %s.' % myTableName)
+            cursor.execute(copy_changes_to_daily)
+            counts['rows'] = max(cursor.rowcount, 0)
+
+@contextmanager
+def memoryInfile(text):
+    """
+    Provide a path that LOAD DATA LOCAL INFILE can read text from without the text being 
+    written to disk. See pipeInfile.
+
+    Parameters:
+        text (String) - the data to provide.
+    Returns:
+        (context manager) - yields the path to pass to LOAD DATA.
+    """
+
+    with pipeInfile([text.encode()]) as path:
+        yield path
+
+@contextmanager
+def pipeInfile(chunks):
+    """
+    Provide a path that LOAD DATA LOCAL INFILE reads a sequence of chunks of data from, one 
+    after the other. The path is a named pipe fed by a background thread, so only the chunk
+    being read has to be in memory. On systems without named pipes the chunks are written to 
+    a temporary file instead. An error raised while producing the chunks is raised again when
+    the context exits.
+
+    Parameters:
+        chunks (iterable) - the data to provide, as bytes.
+    Returns:
+        (context manager) - yields the path to pass to LOAD DATA.
+    """
+
+    tmpdir = tempfile.mkdtemp(prefix='isd_')
+    path = os.path.join(tmpdir, 'day.csv')
+    writer = None
+    errors = list()
+
+    def feed():
+        try:
+            with open(path, 'wb') as f:
+                for data in chunks:
+                    f.write(data)
+        except OSError as e:
+            errors.append(e)
+
+    if hasattr(os, 'mkfifo'):
+        os.mkfifo(path)
+        writer = threading.Thread(target=feed, daemon=True)
+        writer.start()
+    else:
+        feed()
+
+    try:
+        yield path
+    finally:
+
+        # If the load failed before the pipe was read to the end the writer is still waiting
+        # on it. Open the other end ourselves and drain it so the writer can finish. 
+
+        if writer is not None and writer.is_alive():
+            fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+            try:
+                while writer.is_alive():
+                    try:
+                        if os.read(fd, 65536) == b'':
+                            writer.join(0.01)
+                    except BlockingIOError:
+                        writer.join(0.01)
+            finally:
+                os.close(fd)
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    if len(errors) > 0:
+        raise errors[0]
 
 def parseDateFromFilename(filename):
     """
     Parses date from file name. 
 
     Parameters: 
-        filename (String) - The file name to be parsed. 
+        filename (String) - The file name to be parsed, ending in yyyymmdd.csv. 
+    Returns:
+        myDate (String) - the date in format yyyymmdd.
     """
 
-    idx = len(filename)-12
-    myDate = filename[idx:(idx+8)]
+    match = DAY_FILE.search(filename)
+    if match is None:
+        raise ValueError('%s is not a daily .csv file' % filename)
+    myDate = match.group(1)
     return myDate
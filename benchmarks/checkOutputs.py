@@ -0,0 +1,260 @@
+"""
+Checks that the output of the ISD Lite pipeline doesn't depend on the options that are only
+meant to make it faster or smaller. Synthetic station-years are generated into a local mirror,
+as for the benchmarks, and the outputs are compared:
+
+    python benchmarks/checkOutputs.py
+
+Run it from the top of the repository. It exits with status 1 if a check fails. See
+benchmarks/README.md.
+"""
+
+import os
+import io
+import sys
+import gzip
+import shutil
+import filecmp
+import argparse
+import tempfile
+import warnings
+import pandas as pd
+
+from datetime import datetime
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthISD import synthStations, writeHistory, writeMirror
+from benchmarks.mirror import serveMirror
+from ISD_Lite_Processing.parseISD import parseISD, HEADINGS, WIDTHS
+from ISD_Lite_Processing.processISDLite import processISDLite, processISDLiteChunks
+from ISD_Lite_Processing.watermarks import advanceWatermarks
+from ISD_Obs import convertISD, writeDays, dayFrames, daysEnd
+
+VARIABLES = ['Air Temperature', 'Dew Point Temperature', 'Sea Level Pressure', 'Wind Direction', 'Wind Speed Rate',
+             'Sky Condition Code', 'Precip']
+
+# Records that the synthetic archive doesn't have: every field missing, lines cut short after the
+# time or part way through a field, blank lines, a line of spaces and no newline at the end.
+
+EDGE_RECORDS = (b'2020 01 01 00   -56   -94 10193   320    41     0     0 -9999\n'
+                b'2020 01 01 01 -9999 -9999 -9999 -9999 -9999 -9999 -9999 -9999\n'
+                b'\n'
+                b'2020 01 01 02   -61  -100\n'
+                b'2020 01 01 03\n'
+                b'                                                               \n'
+                b'2020 01 01 04   -67  -106 10201   310    3\n'
+                b'2020 01 01 05   -72  -111 10205   300    36     8 -9999    25')
+
+def legacyParseISD(filename):
+    """
+    The read_fwf parser parseISD replaced. It only ever read unpacked .isd files, so .gz files are
+    decompressed for it here. The time is put together with to_datetime rather than the parse_dates
+    argument of read_fwf, which newer versions of pandas no longer take.
+    """
+
+    compression = 'gzip' if filename.endswith('.gz') else None
+    df = pd.read_fwf(filename, names=HEADINGS, header=None, widths=WIDTHS, na_values=[-9999], compression=compression)
+    times = pd.to_datetime(df[['Year', 'Month', 'Day', 'Hour']].rename(columns=str.lower))
+    df = df.drop(columns=['Year', 'Month', 'Day', 'Hour'])
+    df.insert(0, 'Datetime', times)
+
+    for col in ['Air Temperature', 'Dew Point Temperature', 'Sea Level Pressure', 'Wind Speed Rate',
+                'One Hour Precip Depth', 'Six Hour Precip Depth']:
+        df[col] = df[col] / 10
+    return df
+
+def checkParse(workdir, files):
+    """
+    Parse ISD files with parseISD and with the read_fwf parser it replaced, and check that they
+    give the same values, including missing values, blank lines and lines cut short.
+
+    Returns:
+        problems (list) - a description of every file parsed differently.
+    """
+
+    edge = os.path.join(workdir, 'edge-records.isd.gz')
+    with gzip.open(edge, 'wb') as f:
+        f.write(EDGE_RECORDS)
+
+    problems = list()
+    for filename in list(files) + [edge]:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            expected = legacyParseISD(filename)
+        try:
+            pd.testing.assert_frame_equal(parseISD(filename), expected, check_dtype=False)
+        except AssertionError as e:
+            problems.append('%s: %s' % (os.path.basename(filename), str(e).splitlines()[0]))
+    return problems
+
+def checkCompactCSV(workdir, mirror, icaos, starttime, endtime):
+    """
+    Write the daily .csv files of ISD_Obs from the default and the compact schema and check that
+    they are byte for byte the same.
+
+    Returns:
+        problems (list) - a description of every file that differs.
+    """
+
+    start = datetime.strptime(starttime, '%Y%m%d_%H')
+    end = datetime.strptime(endtime, '%Y%m%d_%H')
+    csvdirs = dict()
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        with serveMirror(mirror) as url, redirect_stdout(io.StringIO()):
+            for compact in (False, True):
+                df = processISDLite(os.path.join(workdir, 'download') + '/', icaos, list(VARIABLES), starttime,
+                                    endtime, baseurl=url, compact=compact)
+                convertISD(df, VARIABLES)
+                csvdirs[compact] = os.path.join(workdir, 'csv-compact' if compact else 'csv') + '/'
+                shutil.rmtree(csvdirs[compact], ignore_errors=True)
+                os.makedirs(csvdirs[compact])
+                writeDays(df, start, end, csvdirs[compact])
+    finally:
+        os.chdir(cwd)
+
+    return compareDays(csvdirs[False], csvdirs[True], 'the default and the compact schema')
+
+def checkChunkedDays(workdir, mirror, icaos, year, chunk_days=10):
+    """
+    Write the daily .csv files of ISD_Obs for a window that starts in a year the stations have
+    no files for, once in one piece and once a chunk at a time like ISD_Obs does with
+    chunk_days, and check that the same days are written with the same contents. The chunks
+    before the first year are gaps without any station files.
+
+    Returns:
+        problems (list) - a description of every file that differs.
+    """
+
+    start = datetime(year - 1, 12, 1)
+    end = datetime(year, 1, 10, 23)
+    starttime, endtime = start.strftime('%Y%m%d_%H'), end.strftime('%Y%m%d_%H')
+    csvdirs = dict()
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        with serveMirror(mirror) as url, redirect_stdout(io.StringIO()):
+            for chunked in (False, True):
+                csvdirs[chunked] = os.path.join(workdir, 'csv-chunked' if chunked else 'csv-whole') + '/'
+                shutil.rmtree(csvdirs[chunked], ignore_errors=True)
+                os.makedirs(csvdirs[chunked])
+
+                if chunked:
+                    chunks = processISDLiteChunks(os.path.join(workdir, 'download') + '/', icaos, list(VARIABLES),
+                                                  starttime, endtime, chunk_days=chunk_days, baseurl=url)
+                else:
+                    df = processISDLite(os.path.join(workdir, 'download') + '/', icaos, list(VARIABLES), starttime,
+                                        endtime, baseurl=url)
+                    chunks = [(start, end, df)]
+
+                for chunkstart, chunkend, df in chunks:
+                    convertISD(df, VARIABLES)
+                    writeDays(df, chunkstart, chunkend, csvdirs[chunked])
+    finally:
+        os.chdir(cwd)
+
+    return compareDays(csvdirs[False], csvdirs[True], 'the whole window and its chunks')
+
+def checkWatermarks(workdir, mirror, icaos, year):
+    """
+    Advance the watermarks of an incremental run over a window that ends at midnight, the way
+    ISD_Obs does, and check that each station's watermark is its newest observation in the
+    days that are written. The observations at the midnight end time are not written, so a
+    watermark past them would lose them for good.
+
+    Returns:
+        problems (list) - a description of every watermark that is wrong.
+    """
+
+    start = datetime(year, 1, 1)
+    end = datetime(year, 2, 1)
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        with serveMirror(mirror) as url, redirect_stdout(io.StringIO()):
+            df = processISDLite(os.path.join(workdir, 'download') + '/', icaos, list(VARIABLES),
+                                start.strftime('%Y%m%d_%H'), end.strftime('%Y%m%d_%H'), baseurl=url)
+    finally:
+        os.chdir(cwd)
+
+    written = pd.concat([tempdf for day, tempdf in dayFrames(df, start, end, skip_empty=True)], axis=0)
+    expected = written.groupby(written['ICAO'].astype(str))['Datetime'].max()
+    watermarks = advanceWatermarks(dict(), df, until=daysEnd(end))
+
+    problems = list()
+    for station in icaos:
+        if station in expected and watermarks.get(station) != expected[station].to_pydatetime():
+            problems.append('%s watermark is %s, its newest written observation is %s'
+                            % (station, watermarks.get(station), expected[station]))
+    return problems
+
+def compareDays(expected, actual, label):
+    """
+    Compare two directories of daily .csv files byte for byte.
+
+    Returns:
+        problems (list) - a description of every day that is missing or differs.
+    """
+
+    files = sorted(os.listdir(expected))
+    problems = list()
+    for name in sorted(set(files) ^ set(os.listdir(actual))):
+        problems.append('%s is only written by one of %s' % (name, label))
+    match, mismatch, errors = filecmp.cmpfiles(expected, actual, files, shallow=False)
+    for name in mismatch + errors:
+        problems.append('%s differs between %s' % (name, label))
+    return problems
+
+def runChecks(workdir, nstations=3, years=(2020, 2021), seed=0):
+    """
+    Generate the synthetic archive in workdir and run every check.
+
+    Returns:
+        (dict) - check name -> the problems it found.
+    """
+
+    stations = synthStations(nstations)
+    mirror = os.path.join(workdir, 'mirror')
+    files = writeMirror(mirror, stations, years, seed=seed)
+    writeHistory(os.path.join(workdir, 'isd-history.txt'), stations)
+
+    icaos = [icao for icao, usaf, wban in stations]
+    starttime = '%d0101_00' % years[0]
+    endtime = '%d1231_23' % years[-1]
+
+    return {'parseISD': checkParse(workdir, files),
+            'compactCSV': checkCompactCSV(workdir, mirror, icaos, starttime, endtime),
+            'chunkedDays': checkChunkedDays(workdir, mirror, icaos, years[0]),
+            'watermarks': checkWatermarks(workdir, mirror, icaos, years[0])}
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that the ISD Lite output does not depend on speed options.')
+    parser.add_argument('--stations', type=int, default=3, help='number of synthetic stations')
+    parser.add_argument('--years', default='2020,2021', help='comma separated years to generate')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for the synthetic data')
+    parser.add_argument('--workdir', default=None, help='keep the synthetic archive here between runs')
+    args = parser.parse_args()
+
+    workdir = args.workdir if args.workdir is not None else tempfile.mkdtemp(prefix='isd-check-')
+    try:
+        results = runChecks(workdir, args.stations, [int(year) for year in args.years.split(',')], args.seed)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    failed = 0
+    for name, problems in results.items():
+        print('%-16s %s' % (name, 'ok' if len(problems) == 0 else 'FAILED'))
+        for problem in problems[:10]:
+            print('    ' + problem)
+        failed += len(problems) > 0
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
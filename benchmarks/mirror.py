@@ -0,0 +1,36 @@
+import threading
+import functools
+import http.server
+
+from contextlib import contextmanager
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    Serves files from a directory without logging every request.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+@contextmanager
+def serveMirror(root):
+    """
+    Serve a local copy of the ISD Lite archive over HTTP, standing in for NCEI. The server
+    runs on a free port on localhost in a background thread and is shut down on exit.
+
+    Parameters:
+        root (String) - the root directory of the mirror, see synthISD.writeMirror.
+    Returns:
+        (String) - the base URL to pass to processISDLite, ending in a slash.
+    """
+
+    handler = functools.partial(QuietHandler, directory=root)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:%d/' % server.server_address[1]
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
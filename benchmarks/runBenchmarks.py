@@ -0,0 +1,237 @@
+"""
+Benchmarks for the ISD Lite processing pipeline. Synthetic station-years are generated into a
+local mirror of the archive, served over HTTP, and every stage is timed on them:
+
+    python benchmarks/runBenchmarks.py                  run and compare against baseline.json
+    python benchmarks/runBenchmarks.py --save-baseline  run and save the results as the new baseline
+
+Run it from the top of the repository. See benchmarks/README.md.
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+from datetime import datetime
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthISD import synthStations, writeHistory, writeMirror
+from benchmarks.mirror import serveMirror
+from ISD_Lite_Processing.parseISD import parseISD
+from ISD_Lite_Processing.organizePrecip import organizePrecip
+from ISD_Lite_Processing.ISDvariablesort import ISDvariablesort
+from ISD_Lite_Processing.processISDLite import processISDLite
+from ISD_Obs import writeDays
+
+VARIABLES = ['Air Temperature', 'Dew Point Temperature', 'Sea Level Pressure', 'Wind Direction', 'Wind Speed Rate',
+             'Sky Condition Code', 'Precip']
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+def measure(run, setup=None, repeat=5):
+    """
+    Time a benchmark and find its peak memory. Each repeat calls setup first, untimed, and passes
+    what it returns to run. The peak is taken from one extra run under tracemalloc, since tracing
+    slows the code down too much to time it at the same time.
+
+    Parameters:
+        run (function) - the code to measure.
+        setup (function) - Default: None, prepares the argument for run.
+        repeat (int) - Default: 5, the number of timed runs.
+    Returns:
+        (dict) - best and median seconds, peak memory in MB, and the rows run returned.
+    """
+
+    times = list()
+    rows = None
+    for i in range(repeat):
+        arg = setup() if setup is not None else None
+        with redirect_stdout(io.StringIO()):
+            t = time.perf_counter()
+            rows = run(arg)
+            times.append(time.perf_counter() - t)
+
+    arg = setup() if setup is not None else None
+    tracemalloc.start()
+    try:
+        with redirect_stdout(io.StringIO()):
+            run(arg)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    times.sort()
+    return {'best': times[0], 'median': times[len(times) // 2], 'peak_mb': peak / 2**20, 'rows': rows}
+
+def runBenchmarks(workdir, nstations=10, years=(2020, 2021), repeat=5, seed=0):
+    """
+    Generate the synthetic archive in workdir and run every benchmark.
+
+    Parameters:
+        workdir (String) - the directory for the mirror, isd-history.txt and downloads.
+        nstations (int) - Default: 10, the number of stations in the full pipeline benchmarks.
+        years (list) - Default: (2020, 2021), the years to generate.
+        repeat (int) - Default: 5, the number of timed runs of each benchmark.
+        seed (int) - Default: 0, the random seed for the synthetic data.
+    Returns:
+        (dict) - benchmark name -> measurements, see measure.
+    """
+
+    stations = synthStations(nstations)
+    mirror = os.path.join(workdir, 'mirror')
+    files = writeMirror(mirror, stations, years, seed=seed)
+    writeHistory(os.path.join(workdir, 'isd-history.txt'), stations)
+
+    icaos = [icao for icao, usaf, wban in stations]
+    starttime = '%d0101_00' % years[0]
+    endtime = '%d1231_23' % years[-1]
+    results = dict()
+
+    # Single station-year stages.
+
+    sample = files[0]
+
+    def parsed():
+        return parseISD(sample)
+
+    def organized():
+        df = organizePrecip(parsed())
+        df.insert(1, 'ICAO', icaos[0])
+        return df
+
+    results['parseISD'] = measure(lambda arg: len(parseISD(sample)), repeat=repeat)
+    results['organizePrecip'] = measure(lambda df: len(organizePrecip(df)), setup=parsed, repeat=repeat)
+    results['ISDvariablesort'] = measure(lambda df: len(ISDvariablesort(df, list(VARIABLES))), setup=organized,
+                                         repeat=repeat)
+
+    # The full pipeline, downloading from the local mirror into a fresh directory every time.
+    # processISDLite reads isd-history.txt from the working directory.
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        with serveMirror(mirror) as url:
+
+            def fresh():
+                savedir = os.path.join(workdir, 'download') + '/'
+                shutil.rmtree(savedir, ignore_errors=True)
+                return savedir
+
+            results['processISDLite'] = measure(
+                lambda savedir: len(processISDLite(savedir, icaos, list(VARIABLES), starttime, endtime, baseurl=url)),
+                setup=fresh, repeat=repeat)
+
+            with redirect_stdout(io.StringIO()):
+                df = processISDLite(fresh(), icaos, list(VARIABLES), starttime, endtime, baseurl=url)
+    finally:
+        os.chdir(cwd)
+
+    # The daily .csv files written by ISD_Obs for the whole window.
+
+    def csvdir():
+        savedir = os.path.join(workdir, 'csv') + '/'
+        shutil.rmtree(savedir, ignore_errors=True)
+        os.makedirs(savedir)
+        return savedir
+
+    start = datetime.strptime(starttime, '%Y%m%d_%H')
+    end = datetime.strptime(endtime, '%Y%m%d_%H')
+
+    def writeCSV(savedir):
+        writeDays(df, start, end, savedir)
+        return len(df)
+
+    results['csvWriter'] = measure(writeCSV, setup=csvdir, repeat=repeat)
+
+    return results
+
+def compareBaseline(results, baseline, tolerance=0.25):
+    """
+    Print the results next to the baseline and find the regressions, benchmarks whose best time
+    or peak memory grew by more than the tolerance.
+
+    Parameters:
+        results (dict) - the results of this run, see runBenchmarks.
+        baseline (dict) - the saved results to compare against, or None.
+        tolerance (float) - Default: 0.25, the allowed growth as a fraction of the baseline.
+    Returns:
+        regressions (list) - a description of every regression.
+    """
+
+    regressions = list()
+    print('%-16s %10s %10s %10s %10s %10s' % ('benchmark', 'best (s)', 'median (s)', 'peak (MB)', 'vs time', 'vs mem'))
+    for name, result in results.items():
+        vsTime = vsMem = ''
+        if baseline is not None and name in baseline:
+            timeRatio = result['best'] / baseline[name]['best']
+            memRatio = result['peak_mb'] / baseline[name]['peak_mb'] if baseline[name]['peak_mb'] > 0 else 1.0
+            vsTime = '%.2fx' % timeRatio
+            vsMem = '%.2fx' % memRatio
+            if timeRatio > 1 + tolerance:
+                regressions.append('%s is %.2fx slower than the baseline' % (name, timeRatio))
+            if memRatio > 1 + tolerance:
+                regressions.append('%s uses %.2fx the memory of the baseline' % (name, memRatio))
+        print('%-16s %10.4f %10.4f %10.2f %10s %10s' % (name, result['best'], result['median'], result['peak_mb'],
+                                                          vsTime, vsMem))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the ISD Lite processing pipeline on synthetic data.')
+    parser.add_argument('--stations', type=int, default=10, help='number of synthetic stations')
+    parser.add_argument('--years', default='2020,2021', help='comma separated years to generate')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs of each benchmark')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for the synthetic data')
+    parser.add_argument('--workdir', default=None, help='keep the synthetic archive here between runs')
+    parser.add_argument('--output', default=None, help='also write the results to this JSON file')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='baseline JSON file to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown before a regression')
+    args = parser.parse_args()
+
+    config = {'stations': args.stations, 'years': [int(year) for year in args.years.split(',')],
+              'repeat': args.repeat, 'seed': args.seed}
+
+    workdir = args.workdir if args.workdir is not None else tempfile.mkdtemp(prefix='isd-bench-')
+    try:
+        results = runBenchmarks(workdir, config['stations'], config['years'], config['repeat'], config['seed'])
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {'created': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+              'platform': platform.platform(), 'config': config, 'results': results}
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            saved = json.load(f)
+        if saved['config'] == config:
+            baseline = saved['results']
+        else:
+            print('Baseline was run with %s, not comparing.' % saved['config'])
+
+    regressions = compareBaseline(results, baseline, args.tolerance)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=1)
+        print('Saved baseline to %s' % args.baseline)
+
+    for regression in regressions:
+        print('REGRESSION: ' + regression)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
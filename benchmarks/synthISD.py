@@ -0,0 +1,142 @@
+import os
+import gzip
+import numpy as np
+
+from datetime import datetime
+
+# Chance that a field is missing (-9999) in a record that was reported. Sky condition and sea
+# level pressure are left out far more often than the rest, as in the real archive.
+
+MISSING_RATES = {'Air Temperature': 0.005, 'Dew Point Temperature': 0.01, 'Sea Level Pressure': 0.06,
+                 'Wind Direction': 0.08, 'Wind Speed Rate': 0.005, 'Sky Condition Code': 0.3}
+
+# How each day's six hour precip column is reported: every 6 hours, every 3 hours, every
+# 12 hours or not at all. organizePrecip sorts the values by the gap between reports.
+
+PRECIP_CADENCES = [(6, 0.7), (3, 0.15), (12, 0.1), (None, 0.05)]
+
+def synthStationYear(year, seed=0, drop=0.02):
+    """
+    Generate a year of ISD Lite records for one station. Each hour is reported unless it is
+    dropped, fields go missing at the rates in MISSING_RATES, and six hour precip follows a
+    cadence picked day by day from PRECIP_CADENCES with the odd report off the cadence.
+
+    Parameters:
+        year (int) - the year to generate.
+        seed (int) - Default: 0, the random seed. The same seed always gives the same file.
+        drop (float) - Default: 0.02, the fraction of hours without a record.
+    Returns:
+        (bytes) - the contents of the .isd file.
+    """
+
+    rng = np.random.default_rng(seed)
+
+    hours = np.arange(np.datetime64('%d-01-01T00' % year), np.datetime64('%d-01-01T00' % (year + 1)),
+                      np.timedelta64(1, 'h'))
+    n = len(hours)
+    hourOfDay = np.arange(n) % 24
+
+    # Temperatures follow the season and the time of day, in tenths of a degree C.
+
+    doy = np.arange(n) / 24.0
+    temp = 150 - 100 * np.cos(2 * np.pi * doy / 365) - 40 * np.cos(2 * np.pi * (hourOfDay - 3) / 24)
+    temp = np.round(temp + rng.normal(0, 25, n)).astype('int64')
+    dew = temp - np.round(np.abs(rng.normal(40, 30, n))).astype('int64')
+    slp = np.round(rng.normal(10150, 80, n)).astype('int64')
+    speed = np.round(np.abs(rng.normal(35, 25, n))).astype('int64')
+    direction = rng.integers(1, 37, n) * 10
+    direction[speed == 0] = 0
+    sky = rng.integers(0, 11, n)
+    precip1 = np.where(rng.random(n) < 0.1, rng.integers(0, 30, n), -9999)
+
+    # Pick a reporting cadence for every day and add reports that fall off the cadence.
+
+    cadences = [cadence for cadence, p in PRECIP_CADENCES]
+    daily = rng.choice(len(cadences), size=n // 24, p=[p for cadence, p in PRECIP_CADENCES])
+    every = np.array([0 if cadence is None else cadence for cadence in cadences])[np.repeat(daily, 24)]
+    reported = (every > 0) & (hourOfDay % np.maximum(every, 1) == 0)
+    reported |= rng.random(n) < 0.005
+    precip6 = np.where(reported, np.where(rng.random(n) < 0.7, 0, rng.integers(1, 120, n)), -9999)
+
+    fields = [temp, dew, slp, direction, speed, sky]
+    for values, rate in zip(fields, MISSING_RATES.values()):
+        values[rng.random(n) < rate] = -9999
+    fields += [precip1, precip6]
+
+    keep = rng.random(n) >= drop
+    stamps = hours[keep].astype('datetime64[h]').astype(datetime)
+    rows = np.column_stack(fields)[keep]
+
+    lines = ['%04d %02d %02d %02d' % (tms.year, tms.month, tms.day, tms.hour) + ''.join('%6d' % x for x in row)
+             for tms, row in zip(stamps, rows.tolist())]
+    return ('\n'.join(lines) + '\n').encode() if lines else b''
+
+def synthStations(count):
+    """
+    Make up ICAO callsigns and USAF-WBAN pairs for synthetic stations.
+
+    Parameters:
+        count (int) - the number of stations.
+    Returns:
+        (list) - (ICAO, USAF, WBAN) for each station.
+    """
+
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    stations = list()
+    for i in range(count):
+        icao = 'X' + letters[i // 676 % 26] + letters[i // 26 % 26] + letters[i % 26]
+        stations.append((icao, '%06d' % (990000 + i), '%05d' % (90000 + i)))
+    return stations
+
+def writeHistory(filename, stations, begin=19730101, end=None):
+    """
+    Write an isd-history.txt listing the synthetic stations, in the same fixed column layout
+    as the station history published by NCEI.
+
+    Parameters:
+        filename (String) - the file to write.
+        stations (list) - (ICAO, USAF, WBAN) for each station, see synthStations.
+        begin (int) - Default: 19730101, the start of every station's period of record, yyyymmdd.
+        end (int) - Default: None, the end of the period of record. Defaults to the end of this year.
+    """
+
+    if end is None:
+        end = datetime.utcnow().year * 10000 + 1231
+
+    with open(filename, 'w') as f:
+        f.write('Integrated Surface Database Station History (synthetic)\n\n')
+        f.write('USAF   WBAN  STATION NAME                  CTRY ST CALL  LAT     LON      ELEV(M) BEGIN    END\n\n')
+        for i, (icao, usaf, wban) in enumerate(stations):
+            f.write('%-6s %-5s %-29s %-2s   %-2s %-4s  %+07.3f %+08.3f %+07.1f %08d %08d\n'
+                    % (usaf, wban, 'SYNTHETIC STATION %d' % i, 'US', 'NC', icao, 35 + i % 10 * 0.5,
+                       -78 - i % 20 * 0.5, 100.0, begin, end))
+
+def writeMirror(root, stations, years, seed=0, drop=0.02):
+    """
+    Write a directory laid out like the ISD Lite archive, <root>/<year>/USAF-WBAN-YEAR.gz, for
+    every station and year. Files that already exist are left alone.
+
+    Parameters:
+        root (String) - the root directory of the mirror.
+        stations (list) - (ICAO, USAF, WBAN) for each station, see synthStations.
+        years (list) - the years to generate.
+        seed (int) - Default: 0, the random seed.
+        drop (float) - Default: 0.02, the fraction of hours without a record.
+    Returns:
+        filenames (list) - the paths of the files in the mirror.
+    """
+
+    filenames = list()
+    for year in years:
+        yeardir = os.path.join(root, str(year))
+        if not os.path.exists(yeardir):
+            os.makedirs(yeardir)
+        for i, (icao, usaf, wban) in enumerate(stations):
+            filename = os.path.join(yeardir, '%s-%s-%d.gz' % (usaf, wban, year))
+            if not os.path.exists(filename):
+                data = synthStationYear(year, seed=seed * 1000003 + i * 101 + year, drop=drop)
+                with open(filename + '.tmp', 'wb') as f:
+                    f.write(gzip.compress(data))
+                os.replace(filename + '.tmp', filename)
+            filenames.append(filename)
+    return filenames